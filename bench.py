@@ -0,0 +1,189 @@
+import argparse
+import json
+import time
+from datetime import datetime
+
+import numpy as np
+import pytz
+
+from clienti import TabellaClienti
+from durations import LOG_HEADER, ModelloDurate
+from geocache import GeoCache, chiave_geo
+from optimizer import BONUS_ATTIVITA, minuti_stimati
+from spatial import matrice_haversine
+from planner import STRATEGIE, finestra_giornata, pianifica_giro, seleziona_candidati
+from settimana import RAGGRUPPAMENTI, pianifica_settimana
+from travel import MotoreTempiGuida
+
+# --- BENCHMARK OFFLINE DEL PIANIFICATORE ---
+# Clienti sintetici attorno alle zone di main.COORDS; Places, Distance Matrix e
+# Sheets sono sostituiti da finti locali che contano le chiamate.
+# Uso: python bench.py --clienti 100 500 1000 5000 --ripetizioni 2
+#      python bench.py --clienti 1000 5000 --giorni 5 --agenti 3   (piano multi-giorno)
+TZ_ITALY = pytz.timezone('Europe/Rome')
+ZONE = {"Chianti": (43.661888, 11.305728), "Firenze": (43.7696, 11.2558), "Arezzo": (43.4631, 11.8781)}
+SEDE = ZONE["Chianti"]
+PARTENZA = TZ_ITALY.localize(datetime(2026, 10, 19, 7, 30))  # lunedì mattina, riproducibile
+HEADER = ["CLIENTE", "INDIRIZZO", "COMUNE", "CAP", "VISITATO", "TELEFONO", "ATTIVITÀ", "NOTE STORICO"]
+
+
+class FoglioFinto:
+    def __init__(self, righe=None):
+        self.righe = [list(r) for r in (righe or [])]
+        self.chiamate = 0
+        self.id = id(self)
+
+    def get_all_values(self): self.chiamate += 1; return [list(r) for r in self.righe]
+    def append_row(self, riga, **kw): self.chiamate += 1; self.righe.append(list(riga))
+    def append_rows(self, righe, **kw): self.chiamate += 1; self.righe.extend(list(r) for r in righe)
+    def clear(self): self.chiamate += 1; self.righe = []
+    def update(self, range_name=None, values=None, **kw): self.chiamate += 1; self.righe = [list(r) for r in values]
+    def batch_update(self, dati, **kw): self.chiamate += 1
+
+
+class PlacesFinto:
+    # Text search + details come in get_google_data: 2 chiamate per indirizzo trovato
+    def __init__(self, verita):
+        self.verita = verita
+        self.chiamate = 0
+
+    def __call__(self, nome):
+        self.chiamate += 2
+        coords = self.verita.get(nome)
+        return {"coords": coords, "tel": "", "found": True} if coords else {"coords": None, "found": False}
+
+
+class MotoreFinto(MotoreTempiGuida):
+    # Distance Matrix locale: strada x1.3, velocità che cambia con la tratta
+    def _get(self, params):
+        origini = [tuple(map(float, x.split(","))) for x in params["origins"].split("|")]
+        dest = [tuple(map(float, x.split(","))) for x in params["destinations"].split("|")]
+        km = matrice_haversine(origini, dest) * 1.3
+        vel = 35 + 25 * np.tanh(km / 20)  # urbano lento, extraurbano veloce
+        secondi = km / vel * 3600
+        return {"status": "OK", "rows": [{"elements": [{"status": "OK", "duration_in_traffic": {"value": float(v)}} for v in r]} for r in secondi]}
+
+
+def genera_clienti(n, seed):
+    rng = np.random.default_rng(seed)
+    nomi_zone = list(ZONE)
+    righe, verita, log = [HEADER], {}, [LOG_HEADER]
+    for k in range(n):
+        zona = nomi_zone[rng.integers(len(nomi_zone))]
+        lat, lon = np.array(ZONE[zona]) + rng.normal(0, 0.08, 2)
+        nome = f"CLIENTE {k:05d}"
+        comune = f"{zona} {rng.integers(1, 15)}"
+        visitato = "SI" if rng.random() < 0.1 else ""
+        attivita = "Ordine, Espositore" if rng.random() < 0.2 else ""
+        righe.append([nome, f"Via Fittizia {k}", comune, str(50000 + rng.integers(0, 999)), visitato, "", attivita, ""])
+        if rng.random() > 0.02: verita[nome] = (round(float(lat), 6), round(float(lon), 6))  # 2% indirizzi non trovati
+        if rng.random() < 0.3:
+            for _ in range(rng.integers(1, 4)): log.append([nome, "2026-09-01", "10:00", str(rng.integers(10, 45)), ""])
+    vip = [righe[1 + k][0] for k in rng.choice(n, size=max(1, n // 100), replace=False)]
+    return righe, verita, log, vip
+
+
+def esegui(tabella, ws_log, vip, visite, strategia, geo_cache, motore, places, modello=None):
+    def geocodificatore(clienti):
+        out = []
+        for nome, ind, com, cap in clienti:
+            chiave = chiave_geo(ind, com, cap)
+            g = geo_cache.get(chiave, nome)
+            if g is None:
+                g = places(nome)
+                geo_cache.put(chiave, nome, g)
+            out.append(g)
+        return out
+
+    start_t, limit = finestra_giornata(PARTENZA)
+    chiamate_0 = (places.chiamate, motore.chiamate, motore.elementi, ws_log.chiamate + (geo_cache.ws.chiamate if geo_cache.ws else 0))
+    t0 = time.perf_counter()
+    modello = modello or ModelloDurate(ws_log)  # come in app: letto una volta per sessione
+    raw = seleziona_candidati(tabella, sel_forced=vip)
+    rotta = pianifica_giro(raw, tabella, vip, visite, start_t, limit, SEDE, geocodificatore, modello.durata, motore, strategia)
+    geo_cache.flush()
+    ms = (time.perf_counter() - t0) * 1000
+    return modello, {
+        "ms": round(ms, 1),
+        "places": places.chiamate - chiamate_0[0],
+        "dm_richieste": motore.chiamate - chiamate_0[1],
+        "dm_elementi": motore.elementi - chiamate_0[2],
+        "sheets": ws_log.chiamate + (geo_cache.ws.chiamate if geo_cache.ws else 0) - chiamate_0[3],
+        "guida_min": int(sum(p['travel_time'] for p in rotta)),
+        "visite": len(rotta),
+        "attivita": sum(1 for p in rotta if str(p.get(tabella.c_att) or '').strip()),
+        # Obiettivo dell'ottimizzatore: guida meno il bonus attività (~10 min ciascuna)
+        "netto_min": int(sum(p['travel_time'] for p in rotta) - sum(float(minuti_stimati(BONUS_ATTIVITA)) for p in rotta if str(p.get(tabella.c_att) or '').strip())),
+        "rientro": rotta[-1]['arr'].strftime("%H:%M") if rotta else "--:--",
+    }
+
+
+def esegui_settimana(tabella, verita, vip, giorni, agenti, visite, raggruppa):
+    # Piano multi-giorno su tutto l'arretrato con coordinate note (come dopo PRE-CARICA)
+    modello = ModelloDurate(FoglioFinto())
+    pool = []
+    for p in seleziona_candidati(tabella, sel_forced=vip):
+        if p[tabella.c_nom] in verita: p['g_data'] = {"coords": verita[p[tabella.c_nom]], "tel": "", "found": True}; pool.append(p)
+    start_t, limit = finestra_giornata(PARTENZA)
+    t0 = time.perf_counter()
+    piano = pianifica_settimana(pool, tabella, vip, giorni, agenti, [SEDE], (limit - start_t).total_seconds() / 60, visite, modello.durata, raggruppa)
+    ms = (time.perf_counter() - t0) * 1000
+    guida = [sum(g["guida_min"] for g in piano["giorni"] if g["agente"] == a + 1) for a in range(agenti)]
+    return {
+        "ms": round(ms, 1),
+        "giornate": len(piano["giorni"]),
+        "visite": sum(len(g["clienti"]) for g in piano["giorni"]),
+        "vip": sum(g["vip"] for g in piano["giorni"]),
+        "vip_totali": sum(1 for p in pool if p[tabella.c_nom] in vip),  # copertura: tutti, se ci stanno
+        "guida_agenti": guida,
+        "rimanenti": len(piano["rimanenti"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del pianificatore giri")
+    parser.add_argument("--clienti", type=int, nargs="+", default=[100, 500, 1000, 5000])
+    parser.add_argument("--strategie", nargs="+", default=list(STRATEGIE), choices=STRATEGIE)
+    parser.add_argument("--visite", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--ripetizioni", type=int, default=2, help="la prima è a freddo, le altre con cache calde")
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    parser.add_argument("--giorni", type=int, help="misura invece il piano multi-giorno su tutto l'arretrato")
+    parser.add_argument("--agenti", type=int, default=1)
+    parser.add_argument("--raggruppa", default=RAGGRUPPAMENTI[0], choices=RAGGRUPPAMENTI)
+    args = parser.parse_args()
+
+    if args.giorni:
+        risultati = []
+        print(f"{'clienti':>7} {'agenti':>6} {'ms':>8} {'giorni':>6} {'visite':>6} {'vip':>7} {'rimasti':>7}  guida per agente")
+        for n in args.clienti:
+            righe, verita, _, vip = genera_clienti(n, args.seed)
+            ris = esegui_settimana(TabellaClienti(righe), verita, vip, args.giorni, args.agenti, args.visite, args.raggruppa)
+            ris.update(clienti=n, agenti=args.agenti)
+            risultati.append(ris)
+            print(f"{n:>7} {args.agenti:>6} {ris['ms']:>8.1f} {ris['giornate']:>6} {ris['visite']:>6} {str(ris['vip']) + '/' + str(ris['vip_totali']):>7} {ris['rimanenti']:>7}  {ris['guida_agenti']}")
+        if args.json:
+            with open(args.json, "w") as f: json.dump(risultati, f, indent=2)
+        return
+
+    risultati = []
+    print(f"{'clienti':>7} {'strategia':>11} {'run':>5} {'ms':>8} {'places':>7} {'dm_req':>6} {'dm_el':>6} {'sheets':>6} {'guida':>6} {'attiv':>5} {'netto':>6} {'visite':>6} {'rientro':>7}")
+    for n in args.clienti:
+        righe, verita, log, vip = genera_clienti(n, args.seed)
+        for strategia in args.strategie:
+            tabella = TabellaClienti(righe)
+            geo_cache = GeoCache(FoglioFinto())
+            motore = MotoreFinto("finta")
+            places = PlacesFinto(verita)
+            ws_log, modello = FoglioFinto(log), None
+            for r in range(args.ripetizioni):
+                modello, ris = esegui(tabella, ws_log, vip, args.visite, strategia, geo_cache, motore, places, modello)
+                ris.update(clienti=n, strategia=strategia, run="freddo" if r == 0 else "caldo")
+                risultati.append(ris)
+                print(f"{n:>7} {strategia:>11} {ris['run']:>5} {ris['ms']:>8.1f} {ris['places']:>7} {ris['dm_richieste']:>6} {ris['dm_elementi']:>6} {ris['sheets']:>6} {ris['guida_min']:>6} {ris['attivita']:>5} {ris['netto_min']:>6} {ris['visite']:>6} {ris['rientro']:>7}")
+    if args.json:
+        with open(args.json, "w") as f: json.dump(risultati, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pandas as pd
+
+# --- TABELLA CLIENTI (foglio principale letto, pulito e indicizzato una volta) ---
+
+
+class TabellaClienti:
+    def __init__(self, data):
+        df = pd.DataFrame(data[1:], columns=[h.strip().upper() for h in data[0]])
+
+        # 1. RILEVAMENTO COLONNE (MIGLIORATO)
+        self.c_nom = next(c for c in df.columns if "CLIENTE" in c)
+        self.c_ind = next(c for c in df.columns if "INDIRIZZO" in c or "VIA" in c)
+        self.c_com = next(c for c in df.columns if "COMUNE" in c)
+        self.c_cap = next((c for c in df.columns if "CAP" in c), "CAP")
+        self.c_vis = next(c for c in df.columns if "VISITATO" in c)
+
+        # FIX: Cerca "TELEFONO" esatto per primo, poi cerca colonne che contengono "TEL" o "CELL"
+        if "TELEFONO" in df.columns:
+            self.c_tel = "TELEFONO"
+        else:
+            self.c_tel = next((c for c in df.columns if "TELEFONO" in c or "CELL" in c or "TEL" in c), "TELEFONO")
+
+        # Pulizia Dati Telefono (Forza Stringa)
+        if self.c_tel in df.columns:
+            df[self.c_tel] = df[self.c_tel].astype(str).replace('nan', '').replace('None', '')
+
+        self.c_att = next((c for c in df.columns if "ATTIVIT" in c), None)
+        self.c_canv = next((c for c in df.columns if "CANVASS" in c or "PROMO" in c), None)
+        self.c_note_sto = next((c for c in df.columns if "STORICO" in c or "NOTE" in c), None)
+
+        if "CAP" in df.columns: df[self.c_cap] = df[self.c_cap].astype(str).str.replace('.0', '').str.zfill(5)
+
+        self.df = df
+        self.visitato = df[self.c_vis].str.contains('SI|SÌ', case=False, na=False)
+        self.clienti_ordinati = sorted(df[self.c_nom].unique().tolist())
+        self.comuni = sorted(df[self.c_com].unique())
+        self.cap = sorted(df[self.c_cap].unique()) if self.c_cap in df.columns else []
+        self.col_foglio = {}
+        for k, c in enumerate(df.columns): self.col_foglio.setdefault(c, k + 1)
+        # Nome -> riga del foglio (prima occorrenza, header = riga 1): sostituisce ws.find
+        self.righe_foglio = {}
+        for k, nome in enumerate(df[self.c_nom]): self.righe_foglio.setdefault(nome, k + 2)
+        self.caricata = time.time()
+        self._lock = threading.Lock()
+
+    def colonne(self):
+        return self.c_nom, self.c_ind, self.c_com, self.c_cap, self.c_vis, self.c_tel, self.c_att, self.c_canv, self.c_note_sto
+
+    def riga(self, nome):
+        return self.righe_foglio.get(nome)
+
+    def record(self, nome):
+        # Riga cliente come dict (prima occorrenza), per ricomporre i giri salvati
+        riga = self.righe_foglio.get(nome)
+        return self.df.iloc[riga - 2].to_dict() if riga else None
+
+    def segna_visitato(self, nome):
+        # Patch in memoria dopo l'update_cell: evita di rileggere tutto il foglio
+        with self._lock:
+            righe = self.df[self.c_nom] == nome
+            self.df.loc[righe, self.c_vis] = "SI"
+            self.visitato = self.visitato | righe
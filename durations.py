@@ -0,0 +1,73 @@
+import threading
+from datetime import datetime
+from statistics import median
+
+from traccia import conta, errore, span
+
+# --- MODELLO DURATE VISITA (storico LOG_AI letto una volta, poi incrementale) ---
+LOG_HEADER = ["CLIENTE", "DATA", "ORA", "DURATA_MIN", "NOTE_ATTIVITA"]
+DURATA_STANDARD = 20
+EMIVITA_GIORNI = 180      # peso dimezzato per visite di 6 mesi prima
+
+
+class ModelloDurate:
+    def __init__(self, ws_log=None):
+        self.ws_log = ws_log
+        self.visite = {}      # cliente -> [(data, durata)]
+        self.stime = {}       # cliente -> statistiche pre-calcolate
+        self.ha_header = False
+        self._lock = threading.Lock()
+        self.carica()
+
+    def carica(self):
+        if not self.ws_log: return
+        try:
+            with span("sheets.log_ai.leggi") as attr:
+                rows = self.ws_log.get_all_values()
+                attr["righe"] = len(rows)
+        except Exception as e: errore("log_ai.leggi", e); return
+        if not rows: return
+        self.ha_header = True
+        header = [h.strip().upper() for h in rows[0]]
+        try: i_cli, i_data, i_dur = header.index("CLIENTE"), header.index("DATA"), header.index("DURATA_MIN")
+        except ValueError: return
+        with self._lock:
+            for r in rows[1:]:
+                if len(r) <= max(i_cli, i_data, i_dur): continue
+                self._aggiungi(r[i_cli], r[i_data], r[i_dur])
+            for cliente in self.visite: self._ricalcola(cliente)
+
+    def _aggiungi(self, cliente, data, durata):
+        try: durata = float(str(durata).replace(",", "."))
+        except ValueError: return False
+        try: data = datetime.strptime(str(data), "%Y-%m-%d").date()
+        except ValueError: data = None
+        self.visite.setdefault(cliente, []).append((data, durata))
+        return True
+
+    def _ricalcola(self, cliente):
+        visite = self.visite.get(cliente)
+        if not visite: return
+        durate = [d for _, d in visite]
+        oggi = datetime.now().date()
+        pesi = [0.5 ** (((oggi - data).days if data else 0) / EMIVITA_GIORNI) for data, _ in visite]
+        self.stime[cliente] = {
+            "visite": len(durate),
+            "media": sum(durate) / len(durate),
+            "mediana": median(durate),
+            "media_recente": sum(p * d for p, d in zip(pesi, durate)) / sum(pesi),
+        }
+
+    def aggiungi(self, cliente, data, durata):
+        # Da chiamare dopo l'append_row su LOG_AI: aggiorna solo il cliente toccato
+        with self._lock:
+            if self._aggiungi(cliente, data, durata): self._ricalcola(cliente)
+
+    def durata(self, cliente):
+        s = self.stime.get(cliente)
+        if not s: conta("durate.standard"); return DURATA_STANDARD, False
+        conta("durate.appresa")
+        return int(s["media_recente"]), True
+
+    def statistiche(self, cliente):
+        return self.stime.get(cliente)
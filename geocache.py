@@ -0,0 +1,129 @@
+import re
+import threading
+import time
+import unicodedata
+
+from traccia import conta, errore, span
+
+# --- CACHE GEOCODING PERSISTENTE (foglio GEO_CACHE) ---
+GEO_HEADER = ["CHIAVE", "CLIENTE", "LAT", "LNG", "TEL", "FOUND", "TS"]
+GEO_TTL_GIORNI = 90           # indirizzi trovati: cambiano raramente
+GEO_TTL_NON_TROVATO_GIORNI = 2  # indirizzi non trovati: si riprova presto
+
+
+def normalizza_testo(s):
+    s = unicodedata.normalize("NFKD", str(s or "")).encode("ascii", "ignore").decode().lower()
+    s = re.sub(r"[^a-z0-9]+", " ", s)
+    return " ".join(s.split())
+
+
+def chiave_geo(indirizzo, comune, cap=""):
+    cap_pulito = re.sub(r"\D", "", str(cap or ""))
+    return f"{normalizza_testo(indirizzo)}|{normalizza_testo(comune)}|{cap_pulito.zfill(5) if cap_pulito else ''}"
+
+
+def _fmt_coords(g_data):
+    # Stringhe RAW: evita la formattazione locale del foglio (43,66 vs 43.66)
+    if not g_data.get("found") or not g_data.get("coords"): return "", ""
+    return f"{g_data['coords'][0]:.6f}", f"{g_data['coords'][1]:.6f}"
+
+
+class GeoCache:
+    def __init__(self, ws=None, ttl_giorni=GEO_TTL_GIORNI, ttl_non_trovato_giorni=GEO_TTL_NON_TROVATO_GIORNI):
+        self.ws = ws
+        self.ttl = ttl_giorni * 86400
+        self.ttl_nf = ttl_non_trovato_giorni * 86400
+        self.entries = {}      # chiave -> (g_data, ts)
+        self.per_cliente = {}  # cliente -> chiave corrente
+        self.pending = []      # righe da scrivere sul foglio
+        self.righe_foglio = 0
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self.carica()
+
+    def carica(self):
+        if not self.ws: return
+        try:
+            with span("sheets.geo_cache.leggi") as attr:
+                rows = self.ws.get_all_values()
+                attr["righe"] = len(rows)
+        except Exception as e:
+            errore("geo_cache.leggi", e); return
+        if not rows:
+            try: self.ws.append_row(GEO_HEADER)
+            except Exception as e: errore("geo_cache.header", e)
+            return
+        # Le righe successive sovrascrivono le precedenti (append-only)
+        for r in rows[1:]:
+            r = (r + [""] * len(GEO_HEADER))[:len(GEO_HEADER)]
+            chiave, cliente, lat, lng, tel, found, ts = r
+            if not chiave: continue
+            try:
+                trovato = found.strip().upper() == "SI"
+                coords = (float(lat), float(lng)) if trovato else None
+                ts = float(ts or 0)
+            except ValueError: continue
+            self._indicizza(chiave, cliente, {"coords": coords, "tel": tel, "found": trovato}, ts)
+        self.righe_foglio = len(rows) - 1
+
+    def _indicizza(self, chiave, cliente, g_data, ts):
+        vecchia = self.per_cliente.get(cliente) if cliente else None
+        # Indirizzo cambiato: la vecchia voce del cliente non vale più
+        if vecchia and vecchia != chiave and not any(c == vecchia for k, c in self.per_cliente.items() if k != cliente):
+            self.entries.pop(vecchia, None)
+        if cliente: self.per_cliente[cliente] = chiave
+        self.entries[chiave] = (g_data, ts)
+
+    def get(self, chiave, cliente=None):
+        with self._lock:
+            voce = self.entries.get(chiave)
+            if voce:
+                g_data, ts = voce
+                ttl = self.ttl if g_data.get("found") else self.ttl_nf
+                if time.time() - ts < ttl:
+                    if cliente and self.per_cliente.get(cliente) != chiave: self._indicizza(chiave, cliente, g_data, ts)
+                    self.hits += 1
+                    conta("geo_cache.hit")
+                    return dict(g_data)
+            self.misses += 1
+            conta("geo_cache.miss")
+            return None
+
+    def put(self, chiave, cliente, g_data):
+        g_data = g_data or {"coords": None, "found": False}
+        ts = time.time()
+        with self._lock:
+            self._indicizza(chiave, cliente, {"coords": g_data.get("coords"), "tel": g_data.get("tel", ""), "found": bool(g_data.get("found"))}, ts)
+            lat, lng = _fmt_coords(g_data)
+            self.pending.append([chiave, cliente or "", lat, lng, g_data.get("tel", ""), "SI" if g_data.get("found") else "NO", f"{ts:.0f}"])
+
+    def flush(self):
+        with self._lock:
+            righe, self.pending = self.pending, []
+        if not righe or not self.ws: return 0
+        try:
+            with span("sheets.geo_cache.scrivi", righe=len(righe)):
+                self.ws.append_rows(righe, value_input_option="RAW")
+            self.righe_foglio += len(righe)
+        except Exception as e:
+            errore("geo_cache.scrivi", e)
+            with self._lock: self.pending = righe + self.pending
+            return 0
+        if self.righe_foglio > 2 * max(len(self.entries), 50): self.compatta()
+        return len(righe)
+
+    def compatta(self):
+        # Riscrive il foglio con una sola riga per chiave valida
+        if not self.ws: return
+        with self._lock:
+            clienti = {v: k for k, v in self.per_cliente.items()}
+            righe = [GEO_HEADER]
+            for chiave, (g, ts) in self.entries.items():
+                lat, lng = _fmt_coords(g)
+                righe.append([chiave, clienti.get(chiave, ""), lat, lng, g.get("tel", ""), "SI" if g.get("found") else "NO", f"{ts:.0f}"])
+        try:
+            with span("sheets.geo_cache.compatta", righe=len(righe)):
+                self.ws.clear()
+                self.ws.update(range_name="A1", values=righe, value_input_option="RAW")
+            self.righe_foglio = len(righe) - 1
+        except Exception as e: errore("geo_cache.compatta", e)
@@ -0,0 +1,69 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from traccia import legata, span
+
+# --- CLIENT HTTP CONDIVISO (keep-alive, timeout, retry, pool di thread) ---
+TIMEOUT = (3.05, 10)      # connessione, lettura
+MAX_WORKERS = 8
+RETRY_STATUS = (429, 500, 502, 503, 504)
+STATUS_ERRORE_GOOGLE = ("OVER_QUERY_LIMIT", "REQUEST_DENIED", "UNKNOWN_ERROR", "INVALID_REQUEST")
+
+
+class ClientHttp:
+    def __init__(self, pool=16, tentativi=3, backoff=0.5, timeout=TIMEOUT, max_workers=MAX_WORKERS, senza_retry=()):
+        # Si ritenta su errori di connessione e 429/5xx; un timeout di lettura no
+        # (la risposta lenta costerebbe fino a tentativi x timeout in un rerun)
+        retry = Retry(total=tentativi, read=0, backoff_factor=backoff, status_forcelist=RETRY_STATUS,
+                      allowed_methods=frozenset(["GET"]), respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Endpoint dove conviene fallire subito (es. meteo in background con la sua pausa)
+        for prefisso in senza_retry: self.session.mount(prefisso, HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0))
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="http")
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def get_json(self, endpoint, url, params=None, timeout=None):
+        t0 = time.perf_counter()
+        errore = True
+        try:
+            with span(f"http.{endpoint}") as attr:
+                res = self.session.get(url, params=params, timeout=timeout or self.timeout)
+                res.raise_for_status()
+                dati = res.json()
+                errore = isinstance(dati, dict) and dati.get("status") in STATUS_ERRORE_GOOGLE
+                if errore: attr["status"] = dati.get("status")
+                return dati
+        finally:
+            self._registra(endpoint, (time.perf_counter() - t0) * 1000, errore)
+
+    def _registra(self, endpoint, ms, errore):
+        with self._lock:
+            s = self.stats.setdefault(endpoint, {"chiamate": 0, "errori": 0, "ms_totali": 0.0, "ms_max": 0.0})
+            s["chiamate"] += 1
+            s["errori"] += int(errore)
+            s["ms_totali"] += ms
+            s["ms_max"] = max(s["ms_max"], ms)
+
+    def statistiche(self):
+        with self._lock:
+            return {k: {**v, "ms_medi": v["ms_totali"] / v["chiamate"] if v["chiamate"] else 0.0} for k, v in self.stats.items()}
+
+    def mappa(self, fn, lista):
+        # Risultati nello stesso ordine della lista
+        return list(self.executor.map(legata(fn), lista))
+
+    def in_parallelo(self, fn, lista):
+        # Risultati man mano che arrivano (per le barre di avanzamento)
+        fn = legata(fn)
+        futuri = [self.executor.submit(fn, x) for x in lista]
+        for f in as_completed(futuri): yield f.result()
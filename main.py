@@ -1,19 +1,32 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from geopy.distance import geodesic
-from datetime import datetime, timedelta
+from datetime import datetime
 import urllib.parse
-import requests
 import gspread
 from google.oauth2.service_account import Credentials
 import pytz
 import json
-import copy
+import time
+from geocache import GeoCache, chiave_geo
+from travel import MotoreTempiGuida
+from http_client import ClientHttp
+from durations import ModelloDurate, DURATA_STANDARD, LOG_HEADER
+from clienti import TabellaClienti
+from writeback import CodaScritture
+from memoria import MemoriaGiro, MemoriaFoglio, MemoriaFile
+from replanner import ritima_giro, partenza_per_indice
+from meteo import PrevisioniMeteo, METEO_TTL_MIN, METEO_URL
+from planner import finestra_giornata, seleziona_candidati, pianifica_giro, costruisci_indice_clienti
+from optimizer import BONUS_ATTIVITA
+from settimana import RAGGRUPPAMENTI, pianifica_settimana, giro_da_piano, date_lavorative
+from vista import VistaGiro, firma_giro, anagrafica
+from traccia import PROCESSO, inizia, span, segna, conta, errore
 
 # --- 1. CONFIGURAZIONE & DESIGN ---
 st.set_page_config(page_title="Brightstar CRM PRO", page_icon="💼", layout="wide")
 TZ_ITALY = pytz.timezone('Europe/Rome')
+traccia_run = inizia("rerun")  # tempi e contatori di questo rerun (pannello in fondo alla sidebar)
 
 st.markdown("""
     <style>
@@ -28,6 +41,7 @@ st.markdown("""
     .highlight { color: #38bdf8; font-weight: 600; }
     .real-traffic { color: #f59e0b; font-size: 0.8rem; font-style: italic; }
     .ai-badge { font-size: 0.75rem; background-color: #334155; color: #cbd5e1; padding: 2px 8px; border-radius: 4px; }
+    .late-badge { font-size: 0.8rem; color: #f87171; font-weight: bold; border: 1px solid #f87171; padding: 2px 6px; border-radius: 4px; margin-right: 10px;}
     .forced-badge { font-size: 0.8rem; color: #fbbf24; font-weight: bold; border: 1px solid #fbbf24; padding: 2px 6px; border-radius: 4px; margin-right: 10px;}
     .stCheckbox label { color: #e2e8f0 !important; font-weight: 500; }
     .streamlit-expanderHeader { background-color: rgba(255,255,255,0.05) !important; color: white !important; border-radius: 8px; }
@@ -38,165 +52,185 @@ st.markdown("""
 # --- DATI ---
 COORDS = { "Chianti": (43.661888, 11.305728), "Firenze": (43.7696, 11.2558), "Arezzo": (43.4631, 11.8781) }
 SEDE_COORDS = COORDS["Chianti"]
+# Piano multi-giorno: punto di partenza di ogni agente (secrets PARTENZE_AGENTI = [[lat, lon], ...]), default la sede
+PARTENZE_AGENTI = [tuple(c) for c in st.secrets.get("PARTENZE_AGENTI", [SEDE_COORDS])]
+# Zone meteo: le tre di base più quelle opzionali in secrets ([ZONE_METEO] nome = [lat, lon])
+ZONE_METEO = {**COORDS, **{k: tuple(v) for k, v in st.secrets.get("ZONE_METEO", {}).items()}}
 API_KEY = st.secrets.get("GOOGLE_MAPS_API_KEY")
 
+@st.cache_resource
+def get_http():
+    return ClientHttp(senza_retry=(METEO_URL,))
+
 # ==============================================================================
 # 👇 MODIFICA SOLO QUI SOTTO CON IL TUO ID FOGLIO GOOGLE 👇
 ID_DEL_FOGLIO = "1E9Fv9xOvGGumWGB7MjhAMbV5yzOqPtS1YRx-y4dypQ0" 
 # ==============================================================================
 
 # --- GESTIONE MEMORIA PERSISTENTE ---
-def salva_giro_su_foglio(sh_memoria, rotta_data):
-    try:
-        dati_export = copy.deepcopy(rotta_data)
-        now_str = datetime.now(TZ_ITALY).strftime("%Y-%m-%d")
-        for p in dati_export:
-            if isinstance(p.get('arr'), datetime): 
-                p['arr'] = p['arr'].strftime("%Y-%m-%d %H:%M:%S")
-        
-        json_dump = json.dumps(dati_export)
-        sh_memoria.clear()
-        sh_memoria.append_row(["DATA", "JSON_DATA"])
-        sh_memoria.append_row([now_str, json_dump])
-    except Exception as e:
-        print(f"Errore Salvataggio Memoria: {e}")
+@st.cache_resource
+def get_coda_scritture():
+    # Condivisa tra rerun e sessioni: le scritture partono in background a blocchi.
+    # Se una riga del foglio risulta spostata la tabella clienti in cache si rilegge.
+    return CodaScritture(su_righe_spostate=carica_clienti.clear)
 
-def carica_giro_da_foglio(sh_memoria):
-    try:
-        data = sh_memoria.get_all_values()
-        if len(data) > 1:
-            saved_date = data[1][0]
-            today = datetime.now(TZ_ITALY).strftime("%Y-%m-%d")
-            if saved_date == today:
-                rotta = json.loads(data[1][1])
-                for p in rotta:
-                    if p.get('arr'): 
-                        p['arr'] = datetime.strptime(p['arr'], "%Y-%m-%d %H:%M:%S")
-                return rotta
-    except: pass
+@st.cache_resource
+def get_memoria_giro(_ws_mem):
+    # Snapshot compatto + eventi: su file locale se MEMORIA_LOCALE è in secrets, altrimenti su MEMORIA_GIRO
+    percorso = st.secrets.get("MEMORIA_LOCALE")
+    if percorso: return MemoriaGiro(MemoriaFile(percorso), TZ_ITALY)
+    if _ws_mem: return MemoriaGiro(MemoriaFoglio(_ws_mem, get_coda_scritture()), TZ_ITALY)
     return None
 
+def salva_giro(memoria, rotta, tabella):
+    if not memoria: return
+    try: memoria.salva(rotta, tabella)
+    except Exception as e: errore("memoria.salva", e)
+
 # --- AGENTI INTELLIGENTI ---
-def agente_strategico(note_precedenti):
-    if not note_precedenti: return "ℹ️ COACH: Nessuno storico recente. Raccogli info.", "border-left-color: #64748b;"
-    txt = str(note_precedenti).lower()
-    if any(x in txt for x in ['arrabbiato', 'reclamo', 'ritardo', 'problema', 'rotto']):
-        return "🛡️ COACH: Cliente a rischio. Empatia massima.", "border-left-color: #f87171; background: rgba(153, 27, 27, 0.2);"
-    if any(x in txt for x in ['prezzo', 'costoso', 'sconto', 'caro']):
-        return "💎 COACH: Difendi il valore. Non svendere.", "border-left-color: #fb923c; background: rgba(146, 64, 14, 0.2);"
-    if any(x in txt for x in ['interessato', 'preventivo', 'forse']):
-        return "🎯 COACH: È caldo! Oggi devi chiudere.", "border-left-color: #4ade80; background: rgba(22, 101, 52, 0.2);"
-    return f"ℹ️ MEMO: {note_precedenti[:60]}...", "border-left-color: #94a3b8;"
+@st.cache_resource
+def get_meteo():
+    return PrevisioniMeteo(get_http(), TZ_ITALY, int(st.secrets.get("METEO_TTL_MIN", METEO_TTL_MIN)))
 
 def agente_meteo_territoriale():
     try:
-        lats, lons = f"{COORDS['Chianti'][0]},{COORDS['Firenze'][0]},{COORDS['Arezzo'][0]}", f"{COORDS['Chianti'][1]},{COORDS['Firenze'][1]},{COORDS['Arezzo'][1]}"
-        url = f"https://api.open-meteo.com/v1/forecast?latitude={lats}&longitude={lons}&hourly=temperature_2m,precipitation_probability&timezone=Europe%2FRome&forecast_days=1"
-        res = requests.get(url).json()
-        res = res if isinstance(res, list) else [res]
+        previsioni = get_meteo().leggi(ZONE_METEO)
+        if not previsioni: return "METEO N/D", "background: #64748b;"
         needs_auto = False
         details = []
-        for i, z in enumerate(res):
-            nome = ["Chianti", "Firenze", "Arezzo"][i]
-            rain_prob = max(z['hourly']['precipitation_probability'][9:18])
-            temp_media = sum(z['hourly']['temperature_2m'][9:18]) / 9
+        for nome, ore in previsioni.items():
+            rain_prob = max(ore['precipitation_probability'][9:18])
+            temp_media = sum(ore['temperature_2m'][9:18]) / 9
             details.append(f"{nome}: {int(temp_media)}°C/Pioggia {rain_prob}%")
             if rain_prob > 25 or temp_media < 3: needs_auto = True
         msg = f"AUTO 🚗 ({', '.join(details)})" if needs_auto else f"ZONTES 350 🛵 ({', '.join(details)})"
         style = "background: linear-gradient(90deg, #b91c1c, #ef4444);" if needs_auto else "background: linear-gradient(90deg, #15803d, #22c55e);"
         return msg, style
-    except: return "METEO N/D", "background: #64748b;"
+    except Exception as e:
+        errore("meteo.card", e)
+        return "METEO N/D", "background: #64748b;"
 
 # --- CORE FUNCTIONS ---
-def get_real_travel_time(origin_coords, dest_coords):
-    if not API_KEY: 
-        dist = geodesic(origin_coords, dest_coords).km
-        return int(((dist * 1.5) / 40) * 60)
-    try:
-        url = f"https://maps.googleapis.com/maps/api/distancematrix/json?origins={origin_coords[0]},{origin_coords[1]}&destinations={dest_coords[0]},{dest_coords[1]}&departure_time=now&mode=driving&key={API_KEY}"
-        res = requests.get(url).json()
-        if res['status'] == 'OK' and res['rows'][0]['elements'][0]['status'] == 'OK':
-            seconds = res['rows'][0]['elements'][0]['duration_in_traffic']['value']
-            return int(seconds / 60)
-    except: pass
-    dist = geodesic(origin_coords, dest_coords).km
-    return int(((dist * 1.5) / 45) * 60)
-
-def get_google_data(query_list):
+@st.cache_resource
+def get_motore_tempi():
+    return MotoreTempiGuida(API_KEY, http=get_http())
+
+NON_TROVATO = {'coords': None, 'found': False}
+ERRORE_GEO = {'coords': None, 'found': False, 'errore': True}
+
+def get_google_data(query_list, http=None):
+    # http va passato esplicitamente quando si chiama da un thread del pool.
+    # Ritorna i dati trovati, NON_TROVATO se Google risponde ZERO_RESULTS a tutte le query,
+    # oppure un risultato con "errore" (timeout, quota, chiave) da non mettere in cache.
     if not API_KEY: return None
+    http = http or get_http()
+    fallita = False
     for q in query_list:
         try:
-            res = requests.get(f"https://maps.googleapis.com/maps/api/place/textsearch/json?query={urllib.parse.quote(q)}&key={API_KEY}").json()
+            res = http.get_json("places_textsearch", f"https://maps.googleapis.com/maps/api/place/textsearch/json?query={urllib.parse.quote(q)}&key={API_KEY}")
             if res.get('results'):
                 r = res['results'][0]
                 pid = r['place_id']
-                det = requests.get(f"https://maps.googleapis.com/maps/api/place/details/json?place_id={pid}&fields=opening_hours,formatted_phone_number&key={API_KEY}").json()
+                det = http.get_json("places_details", f"https://maps.googleapis.com/maps/api/place/details/json?place_id={pid}&fields=opening_hours,formatted_phone_number&key={API_KEY}")
                 return {"coords": (r['geometry']['location']['lat'], r['geometry']['location']['lng']), "tel": det.get('result', {}).get('formatted_phone_number', ''), "found": True}
-        except: continue
-    return None
+            if res.get('status') != "ZERO_RESULTS":
+                errore("places", RuntimeError(res.get('status', 'risposta senza risultati'))); fallita = True
+        except Exception as e: errore("places", e); fallita = True
+    if fallita: return dict(ERRORE_GEO)
+    conta("places.non_trovato")
+    return dict(NON_TROVATO)
+
+def geocodifica(geo_cache, nome, indirizzo, comune, cap="", http=None):
+    # Prima la cache persistente, poi Google Places solo per i mancanti/scaduti.
+    # In cache vanno solo i trovati e i veri ZERO_RESULTS: dopo un errore si riprova al prossimo giro.
+    chiave = chiave_geo(indirizzo, comune, cap)
+    g_data = geo_cache.get(chiave, nome) if geo_cache else None
+    if g_data is None:
+        g_data = get_google_data([f"{indirizzo}, {comune}, Italy", f"{nome}, {comune}"], http) or dict(NON_TROVATO)
+        if geo_cache and API_KEY and not g_data.get('errore'): geo_cache.put(chiave, nome, g_data)
+    return g_data
+
+def geocodifica_molti(geo_cache, clienti):
+    # clienti: tuple (nome, indirizzo, comune, cap); i mancanti in cache si risolvono in parallelo
+    http = get_http()
+    return http.mappa(lambda c: geocodifica(geo_cache, *c, http=http), clienti)
 
 @st.cache_resource
 def connect_db():
     try:
-        scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-        creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=scopes)
-        client = gspread.authorize(creds)
-        sh = client.open_by_key(ID_DEL_FOGLIO)
-        ws_main = sh.get_worksheet(0)
-        ws_log = sh.worksheet("LOG_AI") if "LOG_AI" in [w.title for w in sh.worksheets()] else None
-        ws_mem = sh.worksheet("MEMORIA_GIRO") if "MEMORIA_GIRO" in [w.title for w in sh.worksheets()] else None
-        return ws_main, ws_log, ws_mem
-    except: return None, None, None
+        with span("sheets.connessione"):
+            scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+            creds = Credentials.from_service_account_info(st.secrets["gcp_service_account"], scopes=scopes)
+            client = gspread.authorize(creds)
+            sh = client.open_by_key(ID_DEL_FOGLIO)
+            ws_main = sh.get_worksheet(0)
+            titoli = [w.title for w in sh.worksheets()]
+            ws_log = sh.worksheet("LOG_AI") if "LOG_AI" in titoli else None
+            ws_mem = sh.worksheet("MEMORIA_GIRO") if "MEMORIA_GIRO" in titoli else None
+            try: ws_geo = sh.worksheet("GEO_CACHE") if "GEO_CACHE" in titoli else sh.add_worksheet("GEO_CACHE", rows=1, cols=7)
+            except Exception as e: errore("geo_cache.foglio", e); ws_geo = None
+            return ws_main, ws_log, ws_mem, ws_geo
+    except Exception as e:
+        errore("connessione_db", e)
+        return None, None, None, None
+
+@st.cache_resource
+def get_geo_cache(_ws_geo):
+    return GeoCache(_ws_geo)
+
+@st.cache_resource(ttl=600)
+def carica_clienti(_ws):
+    # Foglio principale letto e pulito una volta ogni 10 minuti, non a ogni rerun
+    with span("sheets.clienti.leggi") as attr:
+        data = _ws.get_all_values()
+        attr["righe"] = len(data)
+    with span("tabella.prepara"):
+        return TabellaClienti(data)
+
+@st.cache_resource(ttl=600)
+def get_indice_clienti(_tabella, _geo_cache, caricata):
+    # Ricostruito a ogni ricarica della tabella clienti, poi aggiornato incrementalmente
+    return costruisci_indice_clienti(_tabella, _geo_cache)
+
+@st.cache_resource
+def get_modello_durate(_ws_log):
+    # LOG_AI letto una sola volta; poi aggiornato da log_visit
+    return ModelloDurate(_ws_log)
 
 def get_ai_duration(ws_log, cliente):
-    if not ws_log: return 20, False
-    try:
-        df = pd.DataFrame(ws_log.get_all_records())
-        if not df.empty:
-            hist = df[df['CLIENTE'] == cliente]
-            if not hist.empty: return int(hist['DURATA_MIN'].mean()), True
-    except: pass
-    return 20, False
+    if not ws_log: return DURATA_STANDARD, False
+    return get_modello_durate(ws_log).durata(cliente)
 
 def log_visit(ws_log, cliente, durata, note_extra=""):
     if ws_log:
-        if not ws_log.get_all_values(): ws_log.append_row(["CLIENTE", "DATA", "ORA", "DURATA_MIN", "NOTE_ATTIVITA"])
+        modello = get_modello_durate(ws_log)
+        righe = [] if modello.ha_header else [LOG_HEADER]
+        modello.ha_header = True
         now = datetime.now(TZ_ITALY)
-        ws_log.append_row([cliente, now.strftime("%Y-%m-%d"), now.strftime("%H:%M"), durata, note_extra])
+        righe.append([cliente, now.strftime("%Y-%m-%d"), now.strftime("%H:%M"), durata, note_extra])
+        get_coda_scritture().accoda_righe(ws_log, righe)
+        modello.aggiungi(cliente, now.strftime("%Y-%m-%d"), durata)
+
+def ripianifica(route, da, partenza_loc, partenza_t):
+    # Ri-tempifica solo route[da:] con tratte in cache e orologio reale, senza ricalcolare il giro
+    if da >= len(route): return []
+    limite = route[da]['arr'].replace(hour=19, minute=30)
+    return ritima_giro(route, da, partenza_loc, partenza_t, limite, get_motore_tempi(), datetime.now(TZ_ITALY), st.session_state.get('riottimizza_coda', False))
 
 # --- INTERFACCIA ---
-ws, ws_ai, ws_mem = connect_db()
+ws, ws_ai, ws_mem, ws_geo = connect_db()
+geo_cache = get_geo_cache(ws_geo)
 
 if ws:
-    data = ws.get_all_values()
-    df = pd.DataFrame(data[1:], columns=[h.strip().upper() for h in data[0]])
-    
-    # 1. RILEVAMENTO COLONNE (MIGLIORATO)
-    c_nom = next(c for c in df.columns if "CLIENTE" in c)
-    c_ind = next(c for c in df.columns if "INDIRIZZO" in c or "VIA" in c)
-    c_com = next(c for c in df.columns if "COMUNE" in c)
-    c_cap = next((c for c in df.columns if "CAP" in c), "CAP")
-    c_vis = next(c for c in df.columns if "VISITATO" in c)
-    
-    # FIX: Cerca "TELEFONO" esatto per primo, poi cerca colonne che contengono "TEL" o "CELL"
-    if "TELEFONO" in df.columns:
-        c_tel = "TELEFONO"
-    else:
-        c_tel = next((c for c in df.columns if "TELEFONO" in c or "CELL" in c or "TEL" in c), "TELEFONO")
-    
-    # Pulizia Dati Telefono (Forza Stringa)
-    if c_tel in df.columns:
-        df[c_tel] = df[c_tel].astype(str).replace('nan', '').replace('None', '')
-
-    c_att = next((c for c in df.columns if "ATTIVIT" in c), None)
-    c_canv = next((c for c in df.columns if "CANVASS" in c or "PROMO" in c), None)
-    c_note_sto = next((c for c in df.columns if "STORICO" in c or "NOTE" in c), None)
-    
-    if "CAP" in df.columns: df[c_cap] = df[c_cap].astype(str).str.replace('.0','').str.zfill(5)
+    tabella = carica_clienti(ws)
+    df = tabella.df
+    c_nom, c_ind, c_com, c_cap, c_vis, c_tel, c_att, c_canv, c_note_sto = tabella.colonne()
+    indice_clienti = get_indice_clienti(tabella, geo_cache, tabella.caricata)
+    memoria = get_memoria_giro(ws_mem)
 
     # --- AUTO-LOADING MEMORIA ---
-    if 'master_route' not in st.session_state and ws_mem:
-        rotta_salvata = carica_giro_da_foglio(ws_mem)
+    if 'master_route' not in st.session_state and memoria:
+        rotta_salvata = memoria.carica(tabella)
         if rotta_salvata:
             st.session_state.master_route = rotta_salvata
             st.toast("📅 Giro ripristinato dalla memoria!", icon="💾")
@@ -204,163 +238,185 @@ if ws:
     with st.sidebar:
         st.title("💼 CRM Filters")
         num_visite = st.slider("Numero visite:", 1, 15, 8)
-        sel_zona = st.multiselect("Zona", sorted(df[c_com].unique()))
-        sel_cap = st.multiselect("CAP", sorted(df[c_cap].unique()) if c_cap in df.columns else [])
+        sel_zona = st.multiselect("Zona", tabella.comuni)
+        sel_cap = st.multiselect("CAP", tabella.cap)
         st.divider()
         st.markdown("### ⭐ Forzature (VIP)")
-        all_clients_list = sorted(df[c_nom].unique().tolist())
+        all_clients_list = tabella.clienti_ordinati
         sel_forced = st.multiselect("Clienti Prioritari:", all_clients_list)
+        st.checkbox("🔁 Riottimizza il resto del giro", key="riottimizza_coda", help="Dopo scambi, visite fatte o ritardi riordina le tappe rimanenti")
         
         st.divider()
+        if st.button("📍 PRE-CARICA COORDINATE", help="Geocodifica tutto il foglio una volta sola"):
+            righe_clienti = df.drop_duplicates(subset=[c_nom]).to_dict('records')
+            barra = st.progress(0.0, text="Geocodifica clienti...")
+            hits_0, misses_0 = geo_cache.hits, geo_cache.misses
+            clienti = [(r[c_nom], r[c_ind], r[c_com], r.get(c_cap, '')) for r in righe_clienti]
+            http = get_http()
+            falliti = 0
+            for n, g_data in enumerate(http.in_parallelo(lambda c: geocodifica(geo_cache, *c, http=http), clienti), 1):
+                falliti += bool(g_data.get('errore'))
+                if n % 50 == 0: geo_cache.flush()
+                barra.progress(n / len(clienti), text=f"Geocodifica clienti... {n}/{len(clienti)}")
+            geo_cache.flush()
+            st.toast(f"📍 Coordinate pronte ({geo_cache.hits - hits_0} in cache, {geo_cache.misses - misses_0} richieste)", icon="✅")
+            if falliti: st.warning(f"⚠️ {falliti} clienti non geocodificati per errori di rete o quota: rilancia PRE-CARICA più tardi.")
+
+        with st.expander("🗓️ Piano multi-giorno"):
+            giorni_piano = st.number_input("Giorni", 1, 20, 5)
+            agenti_piano = st.number_input("Agenti", 1, 10, 1)
+            raggruppa_piano = st.selectbox("Raggruppa per", RAGGRUPPAMENTI)
+            if st.button("🗓️ PIANIFICA SETTIMANA", use_container_width=True, help="Divide tutti i clienti da visitare (filtri compresi) in giornate e agenti"):
+                raw = seleziona_candidati(tabella, sel_zona, sel_cap, sel_forced)
+                # Solo coordinate già in cache (vedi PRE-CARICA); i prioritari si geocodificano comunque
+                senza = []
+                for p in raw:
+                    g_data = geo_cache.get(chiave_geo(p[c_ind], p[c_com], p.get(c_cap, '')), p[c_nom])
+                    if g_data: p['g_data'] = g_data
+                    elif p[c_nom] in sel_forced: senza.append(p)
+                for p, g_data in zip(senza, geocodifica_molti(geo_cache, [(p[c_nom], p[c_ind], p[c_com], p.get(c_cap, '')) for p in senza])):
+                    p['g_data'] = g_data
+                geo_cache.flush()
+                pool = [p for p in raw if p.get('g_data', {}).get('found')]
+                start_t, limit = finestra_giornata(datetime.now(TZ_ITALY).replace(hour=7, minute=30))
+                with st.spinner(f"⏳ Pianificazione di {len(pool)} clienti..."):
+                    piano = pianifica_settimana(pool, tabella, sel_forced, giorni_piano, agenti_piano, PARTENZE_AGENTI,
+                                                (limit - start_t).total_seconds() / 60, num_visite,
+                                                lambda nome: get_ai_duration(ws_ai, nome), raggruppa_piano)
+                st.session_state.piano_settimana = {"piano": piano, "pool": pool, "senza_coordinate": len(raw) - len(pool)}
+
+        st.divider()
+        with st.expander("📡 Stato API"):
+            stats_http = get_http().statistiche()
+            if stats_http:
+                st.dataframe(pd.DataFrame(stats_http).T[["chiamate", "errori", "ms_medi", "ms_max"]].round(0), use_container_width=True)
+            else: st.caption("Nessuna chiamata esterna finora.")
+            st.caption(f"✍️ Scritture in coda: {get_coda_scritture().in_attesa()}")
+
+        st.divider()
+        if st.button("🔄 RICARICA CLIENTI", help="Rilegge subito il foglio principale"):
+            carica_clienti.clear()
+            st.rerun()
         if st.button("🗑️ RESETTA MEMORIA", type="secondary"):
-             if ws_mem: ws_mem.clear(); ws_mem.append_row(["DATA", "JSON_DATA"])
+             if memoria: memoria.resetta()
              if 'master_route' in st.session_state: del st.session_state.master_route
              st.rerun()
 
     st.markdown("### 🚀 Brightstar CRM Dashboard")
-    msg, style = agente_meteo_territoriale()
+    with span("ui.meteo"): msg, style = agente_meteo_territoriale()
     st.markdown(f"<div class='meteo-card' style='{style}'>{msg}</div>", unsafe_allow_html=True)
 
     # --- CALCOLO NUOVO GIRO ---
     if st.button("CALCOLA NUOVO GIRO", type="primary", use_container_width=True):
-        mask_standard = ~df[c_vis].str.contains('SI|SÌ', case=False, na=False)
-        if sel_zona: mask_standard &= df[c_com].isin(sel_zona)
-        if sel_cap: mask_standard &= df[c_cap].isin(sel_cap)
-        df_final = pd.concat([df[df[c_nom].isin(sel_forced)], df[mask_standard]]).drop_duplicates(subset=[c_nom])
-        raw = df_final.to_dict('records')
+        raw = seleziona_candidati(tabella, sel_zona, sel_cap, sel_forced)
         
         if not raw: st.warning("Nessun cliente da visitare.")
         else:
             with st.spinner("⏳ Ottimizzazione percorso..."):
-                rotta = []
-                now = datetime.now(TZ_ITALY)
-                start_t = now if (7 <= now.hour < 19) else now.replace(hour=7, minute=30) + timedelta(days=(1 if now.hour>=19 else 0))
-                limit = start_t.replace(hour=19, minute=30)
-                curr_t, curr_loc, pool = start_t, SEDE_COORDS, raw.copy()
-
-                while pool and curr_t < limit and len(rotta) < num_visite:
-                    best = None
-                    best_score = float('inf')
-                    for p in pool:
-                        if 'g_data' not in p:
-                            p['g_data'] = get_google_data([f"{p[c_ind]}, {p[c_com]}, Italy", f"{p[c_nom]}, {p[c_com]}"])
-                            if not p['g_data']: p['g_data'] = {'coords': None, 'found': False}
-                        
-                        if not p['g_data']['found']: continue
-                        dist_air = geodesic(curr_loc, p['g_data']['coords']).km
-                        score = dist_air
-                        if p[c_nom] in sel_forced: score -= 100000 
-                        if c_att and p.get(c_att) and str(p[c_att]).strip(): score -= 5
-                        if score < best_score: best_score, best = score, p
-                    
-                    if best:
-                        real_mins = get_real_travel_time(curr_loc, best['g_data']['coords'])
-                        arrival_real = curr_t + timedelta(minutes=real_mins)
-                        if arrival_real > limit: pool.remove(best); continue
-                        dur_visita, learned = get_ai_duration(ws_ai, best[c_nom])
-                        best['arr'], best['travel_time'], best['duration'], best['learned'] = arrival_real, real_mins, dur_visita, learned
-                        rotta.append(best); curr_t = arrival_real + timedelta(minutes=dur_visita); curr_loc = best['g_data']['coords']; pool.remove(best)
-                    else: break
+                start_t, limit = finestra_giornata(datetime.now(TZ_ITALY))
+                rotta = pianifica_giro(raw, tabella, sel_forced, num_visite, start_t, limit, SEDE_COORDS,
+                                       lambda clienti: geocodifica_molti(geo_cache, clienti),
+                                       lambda nome: get_ai_duration(ws_ai, nome), get_motore_tempi())
                 
+                geo_cache.flush()
+                for r in raw:
+                    if r['g_data']['found']: indice_clienti.aggiungi(r[c_nom], r['g_data']['coords'], BONUS_ATTIVITA if c_att and str(r.get(c_att) or '').strip() else 0.0)
                 st.session_state.master_route = rotta
-                if ws_mem: salva_giro_su_foglio(ws_mem, rotta)
+                salva_giro(memoria, rotta, tabella)
                 st.rerun()
 
+    # --- PIANO MULTI-GIORNO ---
+    if 'piano_settimana' in st.session_state:
+        piano, pool = st.session_state.piano_settimana["piano"], st.session_state.piano_settimana["pool"]
+        date_piano = date_lavorative(datetime.now(TZ_ITALY).date(), max([g["giorno"] for g in piano["giorni"]] or [0]))
+        with st.expander(f"🗓️ Piano: {len(piano['giorni'])} giornate, {sum(len(g['clienti']) for g in piano['giorni'])} visite", expanded=True):
+            st.dataframe(pd.DataFrame([{
+                "Agente": g["agente"], "Giorno": date_piano[g["giorno"] - 1].strftime("%a %d/%m"), "Visite": len(g["clienti"]),
+                "Guida (min)": g["guida_min"], "Lavoro (min)": g["lavoro_min"], "VIP": g["vip"],
+                "Clienti": ", ".join(pool[k][c_nom] for k in g["clienti"][:4]) + ("…" if len(g["clienti"]) > 4 else ""),
+            } for g in piano["giorni"]]), use_container_width=True, hide_index=True)
+            st.caption(f"Restano {len(piano['rimanenti'])} clienti per le settimane successive · {st.session_state.piano_settimana['senza_coordinate']} senza coordinate in cache")
+            col_g, col_c = st.columns([3, 1])
+            with col_g:
+                scelta = st.selectbox("Giornata da caricare", range(len(piano["giorni"])),
+                                      format_func=lambda k: f"Agente {piano['giorni'][k]['agente']} · {date_piano[piano['giorni'][k]['giorno'] - 1].strftime('%a %d/%m')}")
+            with col_c:
+                if piano["giorni"] and st.button("📥 CARICA NEL GIRO", use_container_width=True):
+                    giornata = piano["giorni"][scelta]
+                    visitati = set(df.loc[tabella.visitato, c_nom])
+                    giornata = {**giornata, "clienti": [k for k in giornata["clienti"] if pool[k][c_nom] not in visitati]}
+                    start_t, limit = finestra_giornata(datetime.now(TZ_ITALY))
+                    partenza = tuple(PARTENZE_AGENTI[(giornata["agente"] - 1) % len(PARTENZE_AGENTI)])
+                    rotta = giro_da_piano(giornata, pool, tabella, start_t, limit, partenza,
+                                          lambda nome: get_ai_duration(ws_ai, nome), get_motore_tempi())
+                    st.session_state.master_route = rotta
+                    salva_giro(memoria, rotta, tabella)
+                    st.rerun()
+
     # --- VISUALIZZAZIONE GIRO ---
     if 'master_route' in st.session_state:
         route = st.session_state.master_route
-        st.caption(f"🏁 Rientro previsto: {route[-1]['arr'].strftime('%H:%M') if route else '--:--'}")
+        t_giro = time.perf_counter()
+        col_rientro, col_ritardo = st.columns([3, 1])
+        with col_rientro: st.caption(f"🏁 Rientro previsto: {route[-1]['arr'].strftime('%H:%M') if route else '--:--'}")
+        with col_ritardo:
+            if route and st.button("⏱️ RICALCOLA ORARI", use_container_width=True):
+                ripianifica(route, 0, st.session_state.get('ultima_posizione', SEDE_COORDS), datetime.now(TZ_ITALY))
+                salva_giro(memoria, route, tabella)
+                st.rerun()
         
-        for i, p in enumerate(route):
-            ai_lbl = "AI" if p.get('learned') else "Std"
-            # FIX TELEFONO: Priorità a Excel, poi Google.
-            tel_excel = str(p.get(c_tel, '')).strip()
-            tel_google = p['g_data'].get('tel', '')
-            tel_display = tel_excel if tel_excel and len(tel_excel) > 5 else tel_google
-
-            ora_str = p['arr'].strftime('%H:%M')
-            
-            note_old = p.get(c_note_sto, '') if c_note_sto else ''
-            msg_coach, style_coach = agente_strategico(note_old)
-            forced_html = "<span class='forced-badge'>⭐ PRIORITARIO</span>" if p[c_nom] in sel_forced else ""
-            
-            canvass_html = ""
-            valore_canvass = p.get(c_canv, '') if c_canv else ''
-            if valore_canvass and str(valore_canvass).strip():
-                canvass_html = f"""
-<div style="background: linear-gradient(90deg, #059669, #10b981); color: white; padding: 10px; border-radius: 8px; margin-bottom: 10px; font-weight: bold; border: 1px solid #34d399;">
-📢 CANVASS: {valore_canvass}
-</div>
-"""
-
-            # --- CARD HTML ---
-            html_card = f"""
-<div class="client-card">
-<div class="card-header">
-<div style="display:flex; align-items:center;">
-{forced_html}
-<span class="client-name">{i+1}. {p[c_nom]}</span>
-</div>
-<div class="arrival-time">{ora_str}</div>
-</div>
-{canvass_html}
-<div class="strategy-box" style="{style_coach}">
-{msg_coach}
-</div>
-<div class="info-row">
-<span>📍 {p[c_ind]}, {p[c_com]}</span>
-<span class="real-traffic">🚗 Guida: {p['travel_time']} min</span>
-</div>
-<div class="info-row">
-<span class="ai-badge">⏱️ {p['duration']} min ({ai_lbl})</span>
-<span class="highlight">{tel_display}</span>
-</div>
-</div>
-"""
-            st.markdown(html_card, unsafe_allow_html=True)
-
-            # --- ESPANSIONE: SOSTITUZIONE + DATI ---
-            with st.expander("🔄 SOSTITUISCI / DATI CRM"):
+        # Dati delle card (coach, telefono, checklist, HTML) ricalcolati solo quando il giro cambia
+        firma = firma_giro(route, tabella, sel_forced)
+        if st.session_state.get('vista_giro') is None or st.session_state.vista_giro.firma != firma:
+            st.session_state.vista_giro = VistaGiro(route, tabella, sel_forced)
+        vista = st.session_state.vista_giro
+
+        for i, (p, v) in enumerate(zip(route, vista.tappe)):
+            tel_display = v["tel"]
+            st.markdown(v["html"], unsafe_allow_html=True)
+
+            # --- SOSTITUZIONE + DATI: disegnati solo se aperti (selectbox con tutti i clienti) ---
+            if st.checkbox("🔄 SOSTITUISCI / DATI CRM", key=f"apri_{p[c_nom]}"):
                 
                 st.markdown("🔄 **Sostituisci questo cliente:**")
-                clienti_nel_giro = [x[c_nom] for x in route]
-                candidati_sostituzione = [c for c in all_clients_list if c not in clienti_nel_giro]
+                # Prima i clienti più vicini a questa tappa (indice spaziale), poi tutti gli altri
+                vicini = dict(indice_clienti.vicini(v["coords"], 15, escludi=vista.nel_giro, prioritari=sel_forced))
+                candidati_sostituzione = vista.candidati(vicini)
                 
                 col_swap_1, col_swap_2 = st.columns([3, 1])
                 with col_swap_1:
-                    nuovo_cliente_nome = st.selectbox(f"Scegli sostituto:", ["- Seleziona -"] + candidati_sostituzione, key=f"sel_swap_{i}")
+                    nuovo_cliente_nome = st.selectbox(f"Scegli sostituto:", ["- Seleziona -"] + candidati_sostituzione, key=f"sel_swap_{i}",
+                                                      format_func=lambda c: f"📍 {c} · {vicini[c]:.1f} km" if c in vicini else c)
                 with col_swap_2:
                     if st.button("SCAMBIA", key=f"btn_swap_{i}"):
                         if nuovo_cliente_nome != "- Seleziona -":
-                            dati_nuovo = df[df[c_nom] == nuovo_cliente_nome].to_dict('records')[0]
-                            g_data_nuovo = get_google_data([f"{dati_nuovo[c_ind]}, {dati_nuovo[c_com]}, Italy", f"{dati_nuovo[c_nom]}, {dati_nuovo[c_com]}"])
+                            dati_nuovo = tabella.record(nuovo_cliente_nome)
+                            g_data_nuovo = geocodifica(geo_cache, dati_nuovo[c_nom], dati_nuovo[c_ind], dati_nuovo[c_com], dati_nuovo.get(c_cap, ''))
+                            geo_cache.flush()
                             if g_data_nuovo and g_data_nuovo['found']:
                                 dati_nuovo['g_data'] = g_data_nuovo
-                                dati_nuovo['arr'] = p['arr'] 
-                                dati_nuovo['duration'] = p['duration']
-                                dati_nuovo['travel_time'] = p['travel_time']
+                                dati_nuovo['arr'], dati_nuovo['travel_time'] = p['arr'], p['travel_time']
+                                dati_nuovo['duration'], dati_nuovo['learned'] = get_ai_duration(ws_ai, dati_nuovo[c_nom])
+                                partenza_loc, partenza_t = partenza_per_indice(route, i, st.session_state.get('ultima_posizione', SEDE_COORDS))
                                 st.session_state.master_route[i] = dati_nuovo
-                                if ws_mem: salva_giro_su_foglio(ws_mem, st.session_state.master_route)
+                                ripianifica(st.session_state.master_route, i, partenza_loc, partenza_t)
+                                salva_giro(memoria, st.session_state.master_route, tabella)
                                 st.rerun()
                             else:
-                                st.error("Indirizzo sostituto non trovato.")
+                                st.error("Google Maps non raggiungibile, riprova." if g_data_nuovo.get('errore') else "Indirizzo sostituto non trovato.")
                 
                 st.divider()
                 st.markdown("**📂 Anagrafica Completa:**")
-                dati_clean = {k:v for k,v in p.items() if k not in ['g_data', 'arr', 'learned', 'travel_time', 'duration', 'NOTE_SESSION']}
-                st.dataframe(pd.DataFrame([dati_clean]).T, use_container_width=True)
+                st.table(pd.Series(anagrafica(p), name=p[c_nom], dtype=str))
 
             # --- CHECKLIST ATTIVITÀ ---
             tasks_done = []
-            tasks_total = 0
-            if c_att and p.get(c_att):
-                task_list = [t.strip() for t in str(p[c_att]).split(',') if t.strip()]
-                tasks_total = len(task_list)
-                if task_list:
-                    st.markdown("**📋 Checklist:**")
-                    for t_idx, task in enumerate(task_list):
-                        chk_key = f"chk_{i}_{t_idx}_{p[c_nom]}"
-                        if st.checkbox(task, key=chk_key): tasks_done.append(task)
+            tasks_total = len(v["attivita"])
+            if tasks_total:
+                st.markdown("**📋 Checklist:**")
+                for t_idx, task in enumerate(v["attivita"]):
+                    chk_key = f"chk_{i}_{t_idx}_{p[c_nom]}"
+                    if st.checkbox(task, key=chk_key): tasks_done.append(task)
             
             p['NOTE_SESSION'] = st.text_area(f"🎤 Esito Visita {p[c_nom]}:", value=p.get('NOTE_SESSION', ''), key=f"note_{i}", height=70)
             
@@ -383,10 +439,33 @@ if ws:
                         st.toast("⚠️ Attenzione: Attività non completate!", icon="check")
                     
                     try:
-                        ws.update_cell(ws.find(p[c_nom]).row, list(df.columns).index(c_vis)+1, "SI")
+                        riga = tabella.riga(p[c_nom]) or ws.find(p[c_nom]).row
+                        get_coda_scritture().aggiorna_cella(ws, riga, tabella.col_foglio[c_vis], "SI", attesa=(tabella.col_foglio[c_nom], p[c_nom]))
+                        tabella.segna_visitato(p[c_nom])
+                        indice_clienti.rimuovi(p[c_nom])
                         report_extra = (f"[ATTIVITÀ: {', '.join(tasks_done)} su {tasks_total}] " if tasks_total > 0 else "") + (f"[NOTE: {p['NOTE_SESSION']}]" if p['NOTE_SESSION'] else "")
                         log_visit(ws_ai, p[c_nom], p['duration'], report_extra)
                         st.session_state.master_route.pop(i)
-                        if ws_mem: salva_giro_su_foglio(ws_mem, st.session_state.master_route)
+                        st.session_state.ultima_posizione = p['g_data']['coords']
+                        ripianifica(st.session_state.master_route, i, p['g_data']['coords'], datetime.now(TZ_ITALY))
+                        salva_giro(memoria, st.session_state.master_route, tabella)
                         st.rerun()
-                    except: st.error("Errore Salvataggio")
+                    except Exception as e:
+                        errore("fatto", e)
+                        st.error("Errore Salvataggio")
+        segna("ui.giro", t_giro, tappe=len(route))
+
+# --- STRUMENTAZIONE: dove sono andati i millisecondi di questo rerun ---
+with st.sidebar:
+    st.divider()
+    if st.checkbox("⏱️ Tempi di questo rerun", key="mostra_traccia"):
+        dati_traccia = traccia_run.esporta()
+        dati_traccia["processo"] = {k: v for k, v in PROCESSO.esporta().items() if k in ("riepilogo", "contatori", "errori")}  # scritture e meteo in background
+        st.caption(f"Totale: {dati_traccia['durata_ms']:.0f} ms · {len(dati_traccia['span'])} span")
+        if dati_traccia["riepilogo"]:
+            st.dataframe(pd.DataFrame(dati_traccia["riepilogo"]).T.round(1), use_container_width=True)
+        if dati_traccia["contatori"]:
+            st.dataframe(pd.Series(dati_traccia["contatori"], name="n"), use_container_width=True)
+        for e in dati_traccia["errori"] + dati_traccia["processo"]["errori"][-5:]: st.caption(f"⚠️ {e['dove']}: {e['errore']}")
+        st.download_button("⬇️ ESPORTA TRACCIA (JSON)", json.dumps(dati_traccia, indent=2, default=str),
+                           file_name=f"traccia_{traccia_run.inizio:%Y%m%d_%H%M%S}.json", mime="application/json", use_container_width=True)
@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+from traccia import conta, errore, span
+
+# --- MEMORIA GIRO (snapshot compatto versionato + eventi in append) ---
+# Riga 1: header; riga 2: snapshot {"v", "s", "tappe"}; righe 3+: eventi {"s", "t", ...}.
+# Una tappa salva solo chiave cliente, coordinate e orari: l'anagrafica si ricompone
+# dalla tabella clienti in cache. Gli eventi con "s" <= snapshot sono già inclusi
+# (es. righe rimaste da una compattazione) e si ignorano.
+SCHEMA_MEMORIA = 2
+MEMORIA_HEADER = ["DATA", "JSON_DATA"]
+MAX_EVENTI = 20
+FORMATO_ORA = "%Y-%m-%d %H:%M:%S"
+CAMPI_ORARI = ("a", "tt", "d", "l", "ol")
+
+
+def tappa_compatta(p, c_nom):
+    g = p['g_data']
+    t = {"c": p[c_nom], "xy": [round(float(g['coords'][0]), 6), round(float(g['coords'][1]), 6)],
+         "a": p['arr'].strftime(FORMATO_ORA), "tt": int(p['travel_time']), "d": int(p['duration']), "l": int(bool(p.get('learned')))}
+    if g.get('tel'): t["tel"] = g['tel']
+    if p.get('oltre_limite'): t["ol"] = 1
+    if p.get('NOTE_SESSION'): t["n"] = p['NOTE_SESSION']
+    return t
+
+
+def applica_evento(tappe, ev):
+    # Ritorna una nuova lista di tappe compatte con l'evento applicato
+    tappe = list(tappe)
+    if ev["t"] == "fatto":
+        via = set(ev["c"])
+        tappe = [t for t in tappe if t["c"] not in via]
+    elif ev["t"] == "scambio":
+        tappe[ev["i"]] = ev["tappa"]
+    elif ev["t"] == "orari":
+        for k, valori in enumerate(ev["v"], ev["da"]):
+            t = {c: v for c, v in tappe[k].items() if c not in CAMPI_ORARI}
+            t.update({c: v for c, v in zip(CAMPI_ORARI, valori) if c in ("a", "tt", "d", "l") or v})
+            tappe[k] = t
+    return tappe
+
+
+def calcola_eventi(prec, nuove):
+    # Delta da prec a nuove: visite fatte, scambi, orari ricalcolati. None = serve uno snapshot.
+    eventi, corrente = [], prec
+    nomi_prec, nomi_nuovi = [t["c"] for t in prec], [t["c"] for t in nuove]
+    if nomi_prec != nomi_nuovi:
+        if len(nomi_nuovi) < len(nomi_prec) and set(nomi_nuovi) <= set(nomi_prec):
+            via = [c for c in nomi_prec if c not in set(nomi_nuovi)]
+            eventi.append({"t": "fatto", "c": via})
+            corrente = applica_evento(corrente, eventi[-1])
+            if [t["c"] for t in corrente] != nomi_nuovi: return None  # riordino: snapshot
+        elif len(nomi_nuovi) != len(nomi_prec): return None
+    if len(corrente) != len(nuove): return None
+    for i, (a, b) in enumerate(zip(corrente, nuove)):
+        if {c: v for c, v in a.items() if c not in CAMPI_ORARI} != {c: v for c, v in b.items() if c not in CAMPI_ORARI}:
+            eventi.append({"t": "scambio", "i": i, "tappa": b})
+            corrente = applica_evento(corrente, eventi[-1])
+    diversi = [i for i, (a, b) in enumerate(zip(corrente, nuove)) if a != b]
+    if diversi:
+        eventi.append({"t": "orari", "da": diversi[0], "v": [[t.get(c, 0) for c in CAMPI_ORARI] for t in nuove[diversi[0]:]]})
+        corrente = applica_evento(corrente, eventi[-1])
+    return eventi if corrente == nuove else None
+
+
+class MemoriaGiro:
+    def __init__(self, archivio, tz, max_eventi=MAX_EVENTI):
+        self.archivio = archivio
+        self.tz = tz
+        self.max_eventi = max_eventi
+        self.tappe = None      # ultimo stato salvato (tappe compatte)
+        self.giorno = None
+        self.seq = 0           # numero dell'ultimo evento scritto
+        self.eventi = 0        # eventi dall'ultimo snapshot
+        self._lock = threading.Lock()
+
+    def _oggi(self):
+        return datetime.now(self.tz).strftime("%Y-%m-%d")
+
+    def salva(self, rotta, tabella):
+        nuove = [tappa_compatta(p, tabella.c_nom) for p in rotta]
+        oggi = self._oggi()
+        with self._lock:
+            eventi = calcola_eventi(self.tappe, nuove) if self.tappe is not None and self.giorno == oggi else None
+            if eventi is not None and self.eventi + len(eventi) <= self.max_eventi:
+                if not eventi: return
+                righe = []
+                for ev in eventi:
+                    self.seq += 1
+                    righe.append([oggi, json.dumps({"s": self.seq, **ev}, separators=(",", ":"), ensure_ascii=False)])
+                self.archivio.accoda(righe)
+                self.eventi += len(eventi)
+                conta("memoria.eventi", len(eventi))
+            else:
+                # Primo salvataggio, nuovo giro, riordino o troppi eventi: compattazione
+                self.seq += 1
+                snap = {"v": SCHEMA_MEMORIA, "s": self.seq, "tappe": nuove}
+                self.archivio.scrivi_tutto([MEMORIA_HEADER, [oggi, json.dumps(snap, separators=(",", ":"), ensure_ascii=False)]])
+                self.eventi = 0
+                conta("memoria.snapshot")
+            self.tappe, self.giorno = nuove, oggi
+
+    def resetta(self):
+        with self._lock:
+            self.archivio.scrivi_tutto([MEMORIA_HEADER, ["", ""]])
+            self.tappe, self.giorno, self.eventi = None, None, 0
+
+    def carica(self, tabella):
+        # Giro di oggi ricomposto con l'anagrafica della tabella, o None
+        oggi = self._oggi()
+        try:
+            with span("memoria.leggi") as attr:
+                data = self.archivio.leggi()
+                attr["righe"] = len(data)
+            if len(data) < 2 or not data[1] or data[1][0] != oggi: return None
+            snap = json.loads(data[1][1])
+            if isinstance(snap, list): return self._carica_v1(snap)
+            if snap.get("v") != SCHEMA_MEMORIA: return None
+            eventi = [json.loads(r[1]) for r in data[2:] if len(r) > 1 and r[0] == oggi and r[1]]
+            eventi = sorted((ev for ev in eventi if ev["s"] > snap["s"]), key=lambda ev: ev["s"])
+            tappe = snap["tappe"]
+            for ev in eventi: tappe = applica_evento(tappe, ev)
+            with self._lock:
+                self.tappe, self.giorno = tappe, oggi
+                self.seq = max([snap["s"]] + [ev["s"] for ev in eventi])
+                self.eventi = len(eventi)
+            return [self._ricomponi(t, tabella) for t in tappe]
+        except Exception as e:
+            errore("memoria.carica", e)
+            return None
+
+    def _carica_v1(self, rotta):
+        # Formato precedente: righe cliente complete, arr come stringa. Il prossimo salvataggio compatta.
+        for p in rotta:
+            if p.get('arr'): p['arr'] = self.tz.localize(datetime.strptime(p['arr'], FORMATO_ORA))
+        return rotta
+
+    def _ricomponi(self, t, tabella):
+        p = tabella.record(t["c"]) or {**{c: '' for c in tabella.df.columns}, tabella.c_nom: t["c"]}
+        p['g_data'] = {'coords': tuple(t["xy"]), 'tel': t.get("tel", ''), 'found': True}
+        p['arr'] = self.tz.localize(datetime.strptime(t["a"], FORMATO_ORA))
+        p['travel_time'], p['duration'], p['learned'] = t["tt"], t["d"], bool(t["l"])
+        if t.get("ol"): p['oltre_limite'] = True
+        if t.get("n"): p['NOTE_SESSION'] = t["n"]
+        return p
+
+
+class MemoriaFoglio:
+    # Archivio sul foglio MEMORIA_GIRO tramite la coda di scrittura
+    def __init__(self, ws, coda):
+        self.ws = ws
+        self.coda = coda
+        self.righe_scritte = 0
+
+    def leggi(self):
+        self.coda.flush()  # eventuali salvataggi ancora in coda
+        data = self.ws.get_all_values()
+        self.righe_scritte = len(data)
+        return data
+
+    def accoda(self, righe):
+        self.coda.accoda_righe(self.ws, righe)
+        self.righe_scritte += len(righe)
+
+    def scrivi_tutto(self, righe):
+        # Eventi non ancora partiti: già nello snapshot. Quelli scritti si svuotano.
+        self.coda.scarta_righe(self.ws)
+        vuote = [["", ""]] * max(0, self.righe_scritte - len(righe))
+        self.coda.salva_memoria(self.ws, righe + vuote)
+        self.righe_scritte = len(righe)
+
+
+class MemoriaFile:
+    # Archivio locale: una riga JSON per riga del foglio, eventi in append
+    def __init__(self, percorso):
+        self.percorso = percorso
+        self._lock = threading.Lock()
+
+    def leggi(self):
+        with self._lock:
+            if not os.path.exists(self.percorso): return []
+            with open(self.percorso, encoding="utf-8") as f:
+                return [json.loads(r) for r in f if r.strip()]
+
+    def accoda(self, righe):
+        with self._lock, open(self.percorso, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in righe)
+
+    def scrivi_tutto(self, righe):
+        with self._lock:
+            tmp = self.percorso + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(r, ensure_ascii=False) + "\n" for r in righe)
+            os.replace(tmp, self.percorso)
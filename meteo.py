@@ -0,0 +1,84 @@
+import threading
+import time
+from datetime import datetime
+
+from traccia import conta, errore, span
+
+# --- PREVISIONI METEO (cache condivisa per zona e giorno, stale-while-revalidate) ---
+# A cache fredda (avvio o primo rerun del giorno) una sola richiesta nel rerun, senza retry
+# e con METEO_TIMEOUT; altrimenti mancanti e scadute si scaricano in background e la card
+# mostra quello che c'è. Dopo un errore si aspetta prima di riprovare ("METEO N/D").
+METEO_URL = "https://api.open-meteo.com/v1/forecast"
+METEO_TTL_MIN = 60
+METEO_TIMEOUT = (3.05, 5)
+METEO_PAUSA_ERRORE_MIN = 5
+
+
+class PrevisioniMeteo:
+    def __init__(self, http, tz, ttl_min=METEO_TTL_MIN):
+        self.http = http
+        self.tz = tz
+        self.ttl = ttl_min * 60
+        self.cache = {}          # (zona, coords, giorno) -> (hourly, ts)
+        self.in_aggiornamento = False
+        self.pausa_fino = 0.0    # dopo un errore niente richieste fino a questo istante
+        self._lock = threading.Lock()
+
+    def _chiave(self, nome, coords, giorno):
+        return (nome, (round(coords[0], 4), round(coords[1], 4)), giorno)
+
+    def leggi(self, zone):
+        # zone: {nome: (lat, lon)}. Ritorna subito quello che è in cache (anche scaduto).
+        giorno = datetime.now(self.tz).strftime("%Y-%m-%d")
+        out, mancanti, scadute = {}, {}, {}
+        adesso = time.time()
+        with self._lock:
+            for nome, coords in zone.items():
+                voce = self.cache.get(self._chiave(nome, coords, giorno))
+                if not voce: mancanti[nome] = coords; continue
+                out[nome] = voce[0]
+                if adesso - voce[1] >= self.ttl: scadute[nome] = coords
+        conta("meteo.cache_hit", len(out) - len(scadute)); conta("meteo.cache_miss", len(mancanti)); conta("meteo.scadute", len(scadute))
+        if mancanti or scadute:
+            with self._lock:
+                avvia = not self.in_aggiornamento and adesso >= self.pausa_fino
+                if avvia: self.in_aggiornamento = True
+            if avvia and not out:
+                # Niente per oggi: un background non aggiornerebbe la card fino al prossimo click
+                self._aggiorna(mancanti, giorno)
+                with self._lock:
+                    for nome, coords in mancanti.items():
+                        voce = self.cache.get(self._chiave(nome, coords, giorno))
+                        if voce: out[nome] = voce[0]
+            elif avvia: self.http.executor.submit(self._aggiorna, {**mancanti, **scadute}, giorno)
+            else: conta("meteo.rimandato")
+        return {nome: out[nome] for nome in zone if nome in out}
+
+    def _aggiorna(self, zone, giorno):
+        ok = False
+        try: ok = self._scarica(zone, giorno)
+        finally:
+            with self._lock:
+                self.in_aggiornamento = False
+                if not ok: self.pausa_fino = time.time() + METEO_PAUSA_ERRORE_MIN * 60
+
+    def _scarica(self, zone, giorno):
+        # Una sola richiesta Open-Meteo per tutte le zone mancanti
+        nomi = list(zone)
+        params = {
+            "latitude": ",".join(str(zone[n][0]) for n in nomi),
+            "longitude": ",".join(str(zone[n][1]) for n in nomi),
+            "hourly": "temperature_2m,precipitation_probability",
+            "timezone": "Europe/Rome", "forecast_days": 1,
+        }
+        try:
+            with span("meteo.scarica", zone=len(nomi)):
+                res = self.http.get_json("open_meteo", METEO_URL, params=params, timeout=METEO_TIMEOUT)
+            res = res if isinstance(res, list) else [res]
+            ts = time.time()
+            with self._lock:
+                for nome, z in zip(nomi, res): self.cache[self._chiave(nome, zone[nome], giorno)] = (z['hourly'], ts)
+            return True
+        except Exception as e:
+            errore("meteo", e)
+            return False
@@ -0,0 +1,194 @@
+import numpy as np
+
+from spatial import IndiceSpaziale, matrice_haversine
+
+# --- OTTIMIZZATORE PERCORSO ---
+FATTORE_STRADA = 1.5      # km reali / km in linea d'aria
+VEL_MEDIA_KMH = 45
+BONUS_VIP = 100000        # stesso peso del vecchio loop: i VIP passano sempre davanti
+BONUS_ATTIVITA = 5        # km "regalati" ai clienti con attività aperte
+MAX_INSERIMENTO = 200     # candidati più vicini valutati per l'inserimento
+MAX_TENTATIVI = 30
+SOGLIA_INDICE = 2000      # oltre questo numero di candidati si usa l'indice spaziale
+CANDIDATI_INDICE = 40     # k-vicini estratti dall'indice a ogni passo
+
+
+def minuti_stimati(km, velocita=VEL_MEDIA_KMH):
+    return np.asarray(km) * FATTORE_STRADA / velocita * 60
+
+
+def bonus_candidati(vip, attivita):
+    return np.asarray(vip, dtype=bool) * BONUS_VIP + np.asarray(attivita, dtype=bool) * BONUS_ATTIVITA
+
+
+class Costi:
+    # Nodo 0 = partenza, nodi 1..n = candidati
+    def __init__(self, partenza, coords):
+        self.coords = np.vstack([np.asarray(partenza, dtype=float).reshape(1, 2), np.asarray(coords, dtype=float).reshape(-1, 2)])
+
+    def km(self, righe, colonne=None):
+        return matrice_haversine(self.coords[righe], self.coords if colonne is None else self.coords[colonne])
+
+    def stimati(self, righe, colonne=None):
+        return minuti_stimati(self.km(np.atleast_1d(righe), colonne))
+
+
+def _durata_totale(seq, T, dur):
+    # Minuti dalla partenza all'arrivo sull'ultima tappa (seq in posizioni locali di T)
+    t = 0.0
+    for k in range(1, len(seq)):
+        t += T[seq[k - 1], seq[k]]
+        if k < len(seq) - 1: t += dur[seq[k]]
+    return t
+
+
+def _costo(seq, T):
+    return sum(T[a, b] for a, b in zip(seq, seq[1:]))
+
+
+def costruisci(costi, bonus, orizzonte, max_visite, durata_fn):
+    # Nearest-neighbour con bonus VIP/attività e finestra oraria.
+    # Pool grandi: i candidati di ogni passo arrivano dall'indice spaziale (k-vicini con bonus).
+    n = len(costi.coords) - 1
+    libero = np.ones(n + 1, dtype=bool); libero[0] = False
+    bonus_km = np.concatenate([[0.0], bonus])
+    indice = IndiceSpaziale(costi.coords[1:], bonus) if n > SOGLIA_INDICE else None
+    seq, t = [0], 0.0
+    while libero.any() and len(seq) - 1 < max_visite and t < orizzonte:
+        curr = seq[-1]
+        idx = indice.k_vicini(costi.coords[curr], CANDIDATI_INDICE) + 1 if indice else np.flatnonzero(libero)
+        arrivo = t + costi.stimati(curr, idx)[0]
+        score = costi.km([curr], idx)[0] - bonus_km[idx]
+        ok = arrivo <= orizzonte
+        if not ok.any():
+            # Come il vecchio loop: i candidati fuori orario vengono scartati
+            libero[idx] = False
+            if indice:
+                for x in idx: indice.rimuovi(int(x) - 1)
+            continue
+        k = int(np.argmin(np.where(ok, score, np.inf)))
+        j = int(idx[k])
+        seq.append(j); libero[j] = False
+        if indice: indice.rimuovi(j - 1)
+        t = arrivo[k] + durata_fn(j - 1)
+    return seq
+
+
+def migliora(seq, T, dur, orizzonte, vincolati=0):
+    # 2-opt + Or-opt su percorso aperto; seq indicizza T, seq[0] è la partenza fissa.
+    # I primi "vincolati" nodi dopo la partenza non si spostano (es. tappe già fatte).
+    seq = list(seq)
+    best = _costo(seq, T)
+    inizio = 1 + vincolati
+    migliorato = True
+    while migliorato:
+        migliorato = False
+        # 2-opt: inversione di un tratto
+        for i in range(inizio, len(seq) - 1):
+            for j in range(i + 1, len(seq)):
+                cand = seq[:i] + seq[i:j + 1][::-1] + seq[j + 1:]
+                c = _costo(cand, T)
+                if c < best - 1e-9 and _durata_totale(cand, T, dur) <= orizzonte:
+                    seq, best, migliorato = cand, c, True
+        # Or-opt: spostamento di segmenti da 1 a 3 tappe
+        for lung in (1, 2, 3):
+            for i in range(inizio, len(seq) - lung + 1):
+                seg, resto = seq[i:i + lung], seq[:i] + seq[i + lung:]
+                for k in range(inizio, len(resto) + 1):
+                    if k == i: continue
+                    for s in (seg, seg[::-1]):
+                        cand = resto[:k] + s + resto[k:]
+                        c = _costo(cand, T)
+                        if c < best - 1e-9 and _durata_totale(cand, T, dur) <= orizzonte:
+                            seq, best, migliorato = cand, c, True
+                            break
+                    else: continue
+                    break
+    return seq
+
+
+def _inserisci(seq, costi, bonus, orizzonte, max_visite, durata_fn):
+    # Riempie il tempo liberato da 2-opt con l'inserimento più economico
+    n = len(costi.coords) - 1
+    scartati = set()
+    tentativi = 0
+    while len(seq) - 1 < max_visite and tentativi < MAX_TENTATIVI:
+        liberi = np.setdiff1d(np.arange(1, n + 1), np.array(seq + list(scartati), dtype=int))
+        if not len(liberi): break
+        vicini = costi.km(seq, liberi).min(axis=0) - bonus[liberi - 1]
+        liberi = liberi[np.argsort(vicini)[:MAX_INSERIMENTO]]
+        nodi = seq + liberi.tolist()
+        T = costi.stimati(nodi, nodi)
+        dur = np.zeros(len(nodi))
+        dur[1:len(seq)] = [durata_fn(v - 1) for v in seq[1:]]
+        base = _durata_totale(list(range(len(seq))), T, dur)
+        migliore = None
+        for pc in range(len(seq), len(nodi)):
+            for k in range(1, len(seq) + 1):
+                if k < len(seq):
+                    delta = T[k - 1, pc] + T[pc, k] - T[k - 1, k]
+                    extra = delta  # + durata del nuovo, verificata dopo
+                else:
+                    delta = T[k - 1, pc]
+                    extra = delta + dur[k - 1]
+                if base + extra > orizzonte: continue
+                score = delta - bonus[nodi[pc] - 1]
+                if migliore is None or score < migliore[0]: migliore = (score, pc, k)
+        if migliore is None: break
+        _, pc, k = migliore
+        tentativi += 1
+        dur[pc] = durata_fn(nodi[pc] - 1)
+        loc = list(range(k)) + [pc] + list(range(k, len(seq)))
+        cand = [nodi[x] for x in loc]
+        if _durata_totale(list(range(len(cand))), T[np.ix_(loc, loc)], dur[loc]) <= orizzonte: seq = cand
+        else: scartati.add(nodi[pc])
+    return seq
+
+
+def rifinisci_reale(seq, costi, bonus, orizzonte, durata_fn, minuti_fn):
+    # Una sola matrice reale sui nodi del giro scelto ((n+1)^2 elementi a blocchi: 3 richieste
+    # per 15 tappe), poi 2-opt/Or-opt sui tempi veri. Se il giro sfora la finestra si toglie
+    # l'ultima tappa non VIP: la matrice copre già tutte le tratte possibili.
+    T = np.asarray(minuti_fn(costi.coords[seq], costi.coords[seq]), dtype=float)
+    dur = np.array([0.0] + [durata_fn(v - 1) for v in seq[1:]])
+    loc = list(range(len(seq)))
+    loc = migliora(loc, T, dur, max(orizzonte, _durata_totale(loc, T, dur)))
+    while len(loc) > 1 and _durata_totale(loc, T, dur) > orizzonte:
+        k = next((k for k in range(len(loc) - 1, 0, -1) if bonus[seq[loc[k]] - 1] < BONUS_VIP), len(loc) - 1)
+        del loc[k]
+    return [seq[k] for k in loc]
+
+
+def _rifinisci(seq, costi, bonus, orizzonte, max_visite, durata_fn):
+    for _ in range(2):
+        T = costi.stimati(seq, seq)
+        dur = np.array([0.0] + [durata_fn(v - 1) for v in seq[1:]])
+        loc = migliora(list(range(len(seq))), T, dur, orizzonte)
+        seq = [seq[k] for k in loc]
+        prima = len(seq)
+        seq = _inserisci(seq, costi, bonus, orizzonte, max_visite, durata_fn)
+        if len(seq) == prima: break
+    return seq
+
+
+def ottimizza_giro(partenza, coords, orizzonte, max_visite, durata_fn, bonus=None, minuti_fn=None, costi=None):
+    # Ritorna gli indici (in coords) delle tappe nell'ordine di visita.
+    # Costruzione, 2-opt/Or-opt e inserimenti lavorano sulle stime in linea d'aria; con
+    # minuti_fn (origini, destinazioni -> matrice) il giro scelto si rifinisce sui tempi reali.
+    if not len(coords) or max_visite <= 0: return []
+    costi = costi or Costi(partenza, coords)
+    bonus = np.zeros(len(coords)) if bonus is None else np.asarray(bonus, dtype=float)
+    # Due semi: con il bonus attività e con i soli VIP. Si confrontano sull'obiettivo della
+    # costruzione: prima i VIP, poi le visite, poi guida meno bonus attività (in minuti).
+    vip = bonus >= BONUS_VIP
+    migliore = None
+    for bonus_seme in (bonus, vip * float(BONUS_VIP)):
+        seq = _rifinisci(costruisci(costi, bonus_seme, orizzonte, max_visite, durata_fn), costi, bonus_seme, orizzonte, max_visite, durata_fn)
+        tappe = [v - 1 for v in seq[1:]]
+        netto = _costo(list(range(len(seq))), costi.stimati(seq, seq)) - float(minuti_stimati((bonus[tappe] - vip[tappe] * BONUS_VIP).sum()))
+        chiave = (-int(vip[tappe].sum()), -len(seq), netto)
+        if migliore is None or chiave < migliore[0]: migliore = (chiave, seq)
+        if not (bonus % BONUS_VIP).any(): break  # nessuna attività: i due semi coincidono
+    seq = migliore[1]
+    if minuti_fn: seq = rifinisci_reale(seq, costi, bonus, orizzonte, durata_fn, minuti_fn)
+    return [v - 1 for v in seq[1:]]
@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+import pandas as pd
+
+from geocache import chiave_geo
+from optimizer import BONUS_ATTIVITA, Costi, bonus_candidati, costruisci, ottimizza_giro
+from spatial import IndiceSpaziale
+from traccia import span
+
+# --- PIANIFICAZIONE GIRO (nucleo richiamabile senza Streamlit) ---
+# Le dipendenze esterne entrano come funzioni/oggetti: geocodificatore, durate, motore tempi.
+STRATEGIE = ("ottimizzato", "greedy")
+
+
+def finestra_giornata(now):
+    # Partenza adesso se in orario, altrimenti 7:30 (domani se è sera); rientro entro le 19:30
+    start_t = now if (7 <= now.hour < 19) else now.replace(hour=7, minute=30) + timedelta(days=(1 if now.hour >= 19 else 0))
+    return start_t, start_t.replace(hour=19, minute=30)
+
+
+def seleziona_candidati(tabella, sel_zona=(), sel_cap=(), sel_forced=()):
+    df, c_nom = tabella.df, tabella.c_nom
+    with span("piano.filtri") as attr:
+        mask_standard = ~tabella.visitato
+        if sel_zona: mask_standard &= df[tabella.c_com].isin(sel_zona)
+        if sel_cap: mask_standard &= df[tabella.c_cap].isin(sel_cap)
+        df_final = pd.concat([df[df[c_nom].isin(sel_forced)], df[mask_standard]]).drop_duplicates(subset=[c_nom])
+        attr["candidati"] = len(df_final)
+        return df_final.to_dict('records')
+
+
+def costruisci_indice_clienti(tabella, geo_cache):
+    # Indice spaziale sui clienti da visitare già presenti in cache geocoding
+    c_nom, c_ind, c_com, c_cap, c_att = tabella.c_nom, tabella.c_ind, tabella.c_com, tabella.c_cap, tabella.c_att
+    chiavi, coords, bonus, chiavi_viste = [], [], [], set()
+    with span("indice.costruisci") as attr:
+        for r, visitato in zip(tabella.df.to_dict('records'), tabella.visitato):
+            if visitato or r[c_nom] in chiavi_viste: continue
+            g_data = geo_cache.get(chiave_geo(r[c_ind], r[c_com], r.get(c_cap, '')), r[c_nom])
+            if not g_data or not g_data.get('found'): continue
+            chiavi.append(r[c_nom]); coords.append(g_data['coords']); chiavi_viste.add(r[c_nom])
+            bonus.append(BONUS_ATTIVITA if c_att and str(r.get(c_att) or '').strip() else 0.0)
+        attr["clienti"] = len(chiavi)
+        return IndiceSpaziale(coords, bonus, chiavi)
+
+
+def pianifica_giro(raw, tabella, sel_forced, num_visite, start_t, limit, partenza, geocodificatore, durata_fn, motore, strategia="ottimizzato"):
+    # raw: righe cliente (dict); geocodificatore: [(nome, ind, comune, cap)] -> [g_data];
+    # durata_fn: nome -> (minuti, appresa); motore: MotoreTempiGuida o compatibile.
+    c_nom, c_ind, c_com, c_cap, c_att = tabella.c_nom, tabella.c_ind, tabella.c_com, tabella.c_cap, tabella.c_att
+    da_geocodificare = [p for p in raw if 'g_data' not in p]
+    with span("piano.geocodifica", clienti=len(da_geocodificare)):
+        for p, g_data in zip(da_geocodificare, geocodificatore([(p[c_nom], p[c_ind], p[c_com], p.get(c_cap, '')) for p in da_geocodificare])):
+            p['g_data'] = g_data
+    pool = [p for p in raw if p['g_data']['found']]
+
+    durate = {}
+    def durata_pool(j):
+        if j not in durate: durate[j] = durata_fn(pool[j][c_nom])
+        return durate[j][0]
+
+    coords = [p['g_data']['coords'] for p in pool]
+    bonus = bonus_candidati([p[c_nom] in sel_forced for p in pool], [bool(c_att and p.get(c_att) and str(p[c_att]).strip()) for p in pool])
+    orizzonte = (limit - start_t).total_seconds() / 60
+    with span("piano.ottimizza", strategia=strategia, pool=len(pool)):
+        if strategia == "greedy":
+            # Riferimento: il vecchio nearest-neighbour in linea d'aria, senza miglioramenti
+            ordine = [v - 1 for v in costruisci(Costi(partenza, coords), bonus, orizzonte, num_visite, durata_pool)[1:]] if pool else []
+        else:
+            # Ottimizzazione: 2-opt/Or-opt in linea d'aria, poi sul giro scelto con una matrice reale a blocchi
+            ordine = ottimizza_giro(partenza, coords, orizzonte, num_visite, durata_pool, bonus, minuti_fn=motore.minuti_fn(start_t))
+
+    for j in ordine: durata_pool(j)
+    return tempifica([(pool[j], durate[j]) for j in ordine], start_t, limit, partenza, motore)
+
+
+def tempifica(tappe, start_t, limit, partenza, motore):
+    # tappe: [(riga cliente con g_data, (durata, appresa))] in ordine di visita.
+    # Orari con tempi di guida reali; le tappe oltre il limite si saltano.
+    rotta = []
+    curr_t, curr_loc = start_t, partenza
+    with span("piano.tempi", tappe=len(tappe)):
+        for best, (dur_visita, learned) in tappe:
+            real_mins = motore.tempo(curr_loc, best['g_data']['coords'], start_t)
+            arrival_real = curr_t + timedelta(minutes=real_mins)
+            if arrival_real > limit: continue
+            best['arr'], best['travel_time'], best['duration'], best['learned'] = arrival_real, real_mins, dur_visita, learned
+            rotta.append(best); curr_t = arrival_real + timedelta(minutes=dur_visita); curr_loc = best['g_data']['coords']
+    return rotta
@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+import numpy as np
+
+from optimizer import migliora, _durata_totale
+
+# --- RI-PIANIFICAZIONE INCREMENTALE (solo la coda del giro) ---
+
+
+def partenza_per_indice(route, i, posizione_default):
+    # Da dove e quando si parte per raggiungere route[i] secondo il piano attuale
+    if i > 0:
+        prev = route[i - 1]
+        return prev['g_data']['coords'], prev['arr'] + timedelta(minutes=prev['duration'])
+    p = route[i]
+    return posizione_default, p['arr'] - timedelta(minutes=p.get('travel_time', 0))
+
+
+def ritima_giro(route, da, partenza_loc, partenza_t, limite, motore, adesso=None, riottimizza=False):
+    # Ricalcola arrivi e tempi di guida di route[da:] (in place); ritorna le tappe oltre il limite.
+    # motore: MotoreTempiGuida. Le tratte già note valgono anche se scaricate in un'altra fascia
+    # oraria (la fascia corrente si aggiorna in background): nel click solo le tratte mai viste.
+    if da >= len(route): return []
+    if adesso is not None and adesso > partenza_t: partenza_t = adesso
+    coda = route[da:]
+
+    if riottimizza and len(coda) > 2:
+        punti = [partenza_loc] + [p['g_data']['coords'] for p in coda]
+        T = motore.matrice(punti, punti, partenza_t, altre_fasce=True)
+        dur = np.array([0.0] + [p['duration'] for p in coda])
+        seq = list(range(len(punti)))
+        orizzonte = max((limite - partenza_t).total_seconds() / 60, _durata_totale(seq, T, dur))
+        ordine = migliora(seq, T, dur, orizzonte)
+        coda = [coda[k - 1] for k in ordine[1:]]
+        route[da:] = coda
+
+    tappe = [partenza_loc] + [p['g_data']['coords'] for p in coda]
+    tratte = motore.tempi_tratte(list(zip(tappe, tappe[1:])), partenza_t, altre_fasce=True)
+    curr_t, oltre = partenza_t, []
+    for p, minuti in zip(coda, tratte):
+        p['travel_time'] = minuti
+        p['arr'] = curr_t + timedelta(minutes=minuti)
+        p['oltre_limite'] = p['arr'] > limite
+        if p['oltre_limite']: oltre.append(p)
+        curr_t = p['arr'] + timedelta(minutes=p['duration'])
+    return oltre
@@ -0,0 +1,245 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+
+from optimizer import bonus_candidati, minuti_stimati, ottimizza_giro, _costo
+from planner import tempifica
+from spatial import KM_PER_GRADO, IndiceSpaziale, matrice_haversine
+from traccia import span
+
+# --- PIANO MULTI-GIORNO / MULTI-AGENTE (tutto l'arretrato non visitato) ---
+# 1) gruppi per comune/CAP o solo coordinate, spezzati con k-means finché ognuno sta in
+#    una giornata (visite e minuti stimati), poi fusione dei gruppi piccoli vicini;
+# 2) scelta dei giorni: prima quelli con VIP, poi i più "densi" (visite e attività per minuto);
+#    i VIP rimasti fuori entrano nella giornata scelta più vicina che li può accogliere
+#    (al posto dei clienti normali più lontani dal centro);
+# 3) assegnazione agli agenti bilanciando la guida (prima i giorni più lunghi), poi
+#    rabbocco delle giornate non piene con i vicini non assegnati;
+# 4) ottimizzazione in linea d'aria di ogni giornata su tutti i core.
+# I tempi reali arrivano quando un giorno si carica nel giro (tempifica).
+RAGGRUPPAMENTI = ("coordinate", "comune", "cap")
+COSTANTE_BHH = 0.7124     # giro su n punti in un'area A: ~0.7124 * sqrt(n * A) km
+LATO_MINIMO_KM = 1.0      # area minima di un gruppo (punti allineati o coincidenti)
+ITERAZIONI_KMEANS = 12
+SOGLIA_FUSIONE = 0.8      # gruppi sotto l'80% di una giornata provano a unirsi a un vicino
+VICINI_FUSIONE = 6
+RABBOCCO = 2             # candidati extra per ogni posto libero in una giornata
+MIN_PARALLELO = 8         # sotto questo numero di giornate niente processi
+
+
+def _proietta(coords):
+    # Coordinate in km su un piano locale (equirettangolare): basta per raggruppare
+    lat0 = math.radians(float(coords[:, 0].mean()))
+    return np.column_stack([coords[:, 0] * KM_PER_GRADO, coords[:, 1] * KM_PER_GRADO * math.cos(lat0)])
+
+
+def _kmeans(xy, k, rng):
+    # k-means++ + Lloyd, vettoriale; ritorna l'etichetta di ogni punto
+    centri = [xy[rng.integers(len(xy))]]
+    d2 = ((xy - centri[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        p = d2 / d2.sum() if d2.sum() > 0 else None
+        centri.append(xy[rng.choice(len(xy), p=p)])
+        d2 = np.minimum(d2, ((xy - centri[-1]) ** 2).sum(axis=1))
+    centri = np.array(centri)
+    for _ in range(ITERAZIONI_KMEANS):
+        etichette = ((centri ** 2).sum(axis=1)[None, :] - 2 * xy @ centri.T).argmin(axis=1)  # |x|^2 non cambia l'argmin
+        quanti = np.bincount(etichette, minlength=k)
+        somme = np.column_stack([np.bincount(etichette, weights=xy[:, d], minlength=k) for d in (0, 1)])
+        nuovi = np.where(quanti[:, None] > 0, somme / np.maximum(quanti, 1)[:, None], centri)
+        if np.allclose(nuovi, centri): break
+        centri = nuovi
+    return etichette
+
+
+class Raggruppatore:
+    # Stima il carico (minuti) di una giornata su un gruppo di clienti e lo spezza finché ci sta
+    def __init__(self, coords, durate, partenze, orizzonte, max_visite, seed=0):
+        self.xy = _proietta(coords)
+        self.durate = np.asarray(durate, dtype=float)
+        self.km_sede = matrice_haversine(coords, partenze).min(axis=1)
+        self.orizzonte = orizzonte
+        self.max_visite = max_visite
+        self.rng = np.random.default_rng(seed)
+
+    def giro_km(self, idx):
+        # Giro interno al gruppo, stima BHH sul rettangolo che lo contiene
+        if len(idx) < 2: return 0.0
+        lati = np.maximum(np.ptp(self.xy[idx], axis=0), LATO_MINIMO_KM)
+        return COSTANTE_BHH * math.sqrt(len(idx) * lati[0] * lati[1])
+
+    def carico(self, idx):
+        # Andata al punto più vicino + giro interno + visite; il rientro non conta
+        return float(minuti_stimati(self.km_sede[idx].min() + self.giro_km(idx)) + self.durate[idx].sum())
+
+    def sta_in_giornata(self, idx):
+        return len(idx) <= self.max_visite and self.carico(idx) <= self.orizzonte
+
+    def spezza(self, gruppi):
+        finali, coda = [], [np.asarray(g) for g in gruppi if len(g)]
+        while coda:
+            g = coda.pop()
+            if len(g) == 1 or self.sta_in_giornata(g): finali.append(g); continue
+            k = min(len(g), max(2, math.ceil(max(len(g) / self.max_visite, self.carico(g) / self.orizzonte))))
+            etichette = _kmeans(self.xy[g], k, self.rng)
+            ordine = np.argsort(etichette, kind="stable")
+            parti = [p for p in np.split(g[ordine], np.cumsum(np.bincount(etichette, minlength=k))[:-1]) if len(p)]
+            if len(parti) == 1:
+                # Punti coincidenti: taglio a metà
+                parti = [g[:len(g) // 2], g[len(g) // 2:]]
+            coda.extend(parti)
+        return finali
+
+    def fondi(self, gruppi):
+        # Unisce i gruppi piccoli a uno dei vicini più prossimi se insieme stanno ancora in una giornata
+        gruppi = sorted(gruppi, key=self.carico)
+        centri = np.array([self.xy[g].mean(axis=0) for g in gruppi]).reshape(-1, 2)
+        i = 0
+        while i < len(gruppi):
+            g = gruppi[i]
+            if len(g) >= self.max_visite or self.carico(g) >= SOGLIA_FUSIONE * self.orizzonte: i += 1; continue
+            dist = ((centri - centri[i]) ** 2).sum(axis=1); dist[i] = np.inf
+            vicini = np.argsort(dist)[:VICINI_FUSIONE] if len(gruppi) > 1 else []
+            vicino = next((j for j in vicini if j != i and self.sta_in_giornata(np.concatenate([gruppi[j], g]))), None)
+            if vicino is None: i += 1; continue
+            gruppi[vicino] = np.concatenate([gruppi[vicino], g])
+            centri[vicino] = self.xy[gruppi[vicino]].mean(axis=0)
+            del gruppi[i]; centri = np.delete(centri, i, axis=0)
+        return gruppi
+
+    def accogli(self, g, nuovo, obbligatori):
+        # g + nuovo se sta in una giornata, togliendo se serve i non obbligatori più lontani dal
+        # centro. Ritorna (gruppo, tolti) oppure None se non ci sta nemmeno così.
+        g, tolti = np.append(g, nuovo), []
+        while not self.sta_in_giornata(g):
+            liberi = np.flatnonzero(~obbligatori[g])
+            if not len(liberi): return None
+            centro = self.xy[g].mean(axis=0)
+            k = liberi[((self.xy[g[liberi]] - centro) ** 2).sum(axis=1).argmax()]
+            tolti.append(int(g[k])); g = np.delete(g, k)
+        return g, tolti
+
+
+def _ottimizza_giornata(args):
+    # Eseguita nei processi: solo dati semplici, niente API
+    partenza, coords, durate, bonus, orizzonte, max_visite = args
+    ordine = ottimizza_giro(partenza, coords, orizzonte, max_visite, lambda j: durate[j], bonus)
+    punti = np.vstack([np.asarray(partenza, dtype=float).reshape(1, 2), coords[ordine]]) if ordine else None
+    guida = float(_costo(list(range(len(punti))), minuti_stimati(matrice_haversine(punti)))) if ordine else 0.0
+    return ordine, guida
+
+
+def pianifica_settimana(pool, tabella, sel_forced, giorni, agenti, partenze, orizzonte, max_visite, durata_fn,
+                        raggruppa="coordinate", processi=None, seed=0):
+    # pool: righe cliente con g_data trovato; partenze: una posizione per agente.
+    # Ritorna {"giorni": [{"agente", "giorno", "clienti", "guida_min", "lavoro_min", "vip"}], "rimanenti": [...]}
+    # con "clienti" = indici in pool nell'ordine di visita.
+    c_nom, c_att = tabella.c_nom, tabella.c_att
+    if not pool or giorni <= 0 or agenti <= 0: return {"giorni": [], "rimanenti": list(range(len(pool)))}
+    coords = np.array([p['g_data']['coords'] for p in pool], dtype=float)
+    durate = np.array([durata_fn(p[c_nom])[0] for p in pool], dtype=float)
+    vip = np.array([p[c_nom] in sel_forced for p in pool])
+    attivita = np.array([bool(c_att and p.get(c_att) and str(p[c_att]).strip()) for p in pool])
+    bonus = bonus_candidati(vip, attivita)
+    partenze = np.asarray(partenze, dtype=float).reshape(-1, 2)
+    partenze = partenze[np.arange(agenti) % len(partenze)]  # meno partenze che agenti: si riusano
+
+    # 1) Gruppi da una giornata
+    with span("settimana.gruppi", clienti=len(pool)) as attr:
+        rg = Raggruppatore(coords, durate, partenze, orizzonte, max_visite, seed)
+        colonna = {"comune": tabella.c_com, "cap": tabella.c_cap}.get(raggruppa)
+        if colonna:
+            per_chiave = {}
+            for k, p in enumerate(pool): per_chiave.setdefault(str(p.get(colonna, '')), []).append(k)
+            gruppi = rg.spezza(list(per_chiave.values()))
+        else: gruppi = rg.spezza([np.arange(len(pool))])
+        gruppi = rg.fondi(gruppi)
+        attr["gruppi"] = len(gruppi)
+
+    # 2) Giornate da pianificare: VIP, poi visite+attività per minuto di lavoro
+    carichi = [rg.carico(g) for g in gruppi]
+    def priorita(k):
+        g = gruppi[k]
+        return (-int(vip[g].sum()), -(len(g) + attivita[g].sum()) / max(carichi[k], 1.0))
+    scelti = sorted(range(len(gruppi)), key=priorita)[:giorni * agenti]
+
+    # VIP obbligatori: quelli fuori dalle giornate scelte vanno nella più vicina che li accoglie;
+    # i clienti normali tolti per far posto tornano disponibili per il rabbocco
+    in_scelti = np.zeros(len(pool), dtype=bool)
+    for k in scelti: in_scelti[gruppi[k]] = True
+    vip_fuori = np.flatnonzero(vip & ~in_scelti)
+    with span("settimana.vip", fuori=len(vip_fuori)) as attr:
+        centri = np.array([rg.xy[gruppi[k]].mean(axis=0) for k in scelti]).reshape(-1, 2)
+        dist = ((rg.xy[vip_fuori][:, None, :] - centri[None, :, :]) ** 2).sum(axis=2)
+        piazzati = 0
+        for r in np.argsort(dist.min(axis=1, initial=np.inf), kind="stable"):
+            for s in np.argsort(dist[r], kind="stable"):
+                esito = rg.accogli(gruppi[scelti[s]], vip_fuori[r], vip)
+                if esito is None: continue
+                gruppi[scelti[s]] = esito[0]; carichi[scelti[s]] = rg.carico(esito[0])
+                centri[s] = rg.xy[esito[0]].mean(axis=0); piazzati += 1
+                break
+        attr["piazzati"] = piazzati
+
+    # 3) Agenti: guida stimata per agente (dalla sua partenza), la più lunga va al meno carico
+    guida_agente = np.array([minuti_stimati(matrice_haversine(partenze, coords[gruppi[k]]).min(axis=1) + rg.giro_km(gruppi[k])) for k in scelti]).reshape(-1, agenti)
+    totale, assegnati = np.zeros(agenti), [[] for _ in range(agenti)]
+    for r in np.argsort(-guida_agente.min(axis=1), kind="stable"):
+        liberi = [a for a in range(agenti) if len(assegnati[a]) < giorni]
+        a = min(liberi, key=lambda a: totale[a] + guida_agente[r, a])
+        assegnati[a].append(scelti[r]); totale[a] += guida_agente[r, a]
+
+    # Rabbocco: le giornate con posti liberi ricevono come candidati i clienti normali non assegnati
+    # più vicini (i VIP sono già tutti nelle giornate, o non ci stanno)
+    indice = IndiceSpaziale(coords, bonus_candidati(np.zeros(len(pool)), attivita))
+    for x in np.flatnonzero(vip): indice.rimuovi(int(x))
+    for k in scelti:
+        for x in gruppi[k]: indice.rimuovi(int(x))
+    for k in sorted(scelti, key=priorita):
+        liberi = max_visite - len(gruppi[k])
+        if liberi <= 0: continue
+        extra = indice.k_vicini(coords[gruppi[k]].mean(axis=0), RABBOCCO * liberi)
+        for x in extra: indice.rimuovi(int(x))
+        gruppi[k] = np.concatenate([gruppi[k], extra])
+
+    # 4) Ottimizzazione delle giornate, in parallelo se sono tante
+    lavori, chiavi = [], []
+    for a in range(agenti):
+        for d, k in enumerate(sorted(assegnati[a], key=priorita)):
+            g = gruppi[k]
+            lavori.append((tuple(partenze[a]), coords[g], durate[g], bonus[g], orizzonte, max_visite))
+            chiavi.append((a, d, g))
+    processi = processi or os.cpu_count() or 1
+    with span("settimana.ottimizza", giornate=len(lavori), processi=processi if len(lavori) >= MIN_PARALLELO else 1):
+        if len(lavori) >= MIN_PARALLELO and processi > 1:
+            # Mai fork: il server Streamlit ha thread (pool HTTP, coda scritture) con lock presi
+            metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            with ProcessPoolExecutor(max_workers=processi, mp_context=multiprocessing.get_context(metodo)) as ex:
+                risultati = list(ex.map(_ottimizza_giornata, lavori, chunksize=max(1, len(lavori) // (4 * processi))))
+        else: risultati = [_ottimizza_giornata(l) for l in lavori]
+
+    piano, in_piano = [], set()
+    for (a, d, g), (ordine, guida) in zip(chiavi, risultati):
+        clienti = [int(g[j]) for j in ordine]
+        in_piano.update(clienti)
+        piano.append({"agente": a + 1, "giorno": d + 1, "clienti": clienti, "guida_min": int(guida),
+                      "lavoro_min": int(guida + durate[clienti].sum()), "vip": int(vip[clienti].sum())})
+    return {"giorni": piano, "rimanenti": [k for k in range(len(pool)) if k not in in_piano]}
+
+
+def giro_da_piano(giornata, pool, tabella, start_t, limit, partenza, durata_fn, motore):
+    # Una giornata del piano come giro (stesso formato di pianifica_giro), con tempi reali; pool non si tocca
+    return tempifica([(dict(pool[k]), durata_fn(pool[k][tabella.c_nom])) for k in giornata["clienti"]], start_t, limit, partenza, motore)
+
+
+def date_lavorative(inizio, n):
+    # Prossimi n giorni lun-ven a partire da inizio (incluso)
+    out, giorno = [], inizio
+    while len(out) < n:
+        if giorno.weekday() < 5: out.append(giorno)
+        giorno += timedelta(days=1)
+    return out
@@ -0,0 +1,166 @@
+import math
+import threading
+
+import numpy as np
+
+# --- INDICE SPAZIALE A GRIGLIA (k-vicini e raggio con bonus VIP/attività) ---
+# Celle di ~cella_km in gradi; le ricerche si allargano ad anelli finché nessun punto
+# più lontano può battere i candidati trovati, tenuto conto del bonus massimo "normale".
+# I bonus oltre la soglia (VIP) non sono legati alla distanza: quei punti tornano sempre.
+# L'indice dei clienti è condiviso tra le sessioni: letture e modifiche passano dal lock.
+R_TERRA_KM = 6371.0088
+KM_PER_GRADO = 111.2
+SOGLIA_VIP = 1000
+PRIORITA = 1e9
+
+
+def matrice_haversine(a, b=None):
+    a = np.radians(np.asarray(a, dtype=float).reshape(-1, 2))
+    b = a if b is None else np.radians(np.asarray(b, dtype=float).reshape(-1, 2))
+    dlat = b[None, :, 0] - a[:, None, 0]
+    dlon = b[None, :, 1] - a[:, None, 1]
+    h = np.sin(dlat / 2) ** 2 + np.cos(a[:, None, 0]) * np.cos(b[None, :, 0]) * np.sin(dlon / 2) ** 2
+    return 2 * R_TERRA_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+class IndiceSpaziale:
+    def __init__(self, coords=(), bonus=None, chiavi=None, cella_km=2.0):
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        self.cella_km = cella_km
+        lat0 = float(coords[:, 0].mean()) if len(coords) else 43.7
+        self.dlat = cella_km / KM_PER_GRADO
+        self.dlon = cella_km / (KM_PER_GRADO * math.cos(math.radians(lat0)))
+        self.coords = coords
+        self.bonus = np.zeros(len(coords)) if bonus is None else np.asarray(bonus, dtype=float).copy()
+        self.attivi = np.ones(len(coords), dtype=bool)
+        self.chiavi = list(chiavi) if chiavi is not None else list(range(len(coords)))
+        self.pos = {k: i for i, k in enumerate(self.chiavi)}
+        self.celle = {}
+        if len(coords):
+            ci = np.floor(coords[:, 0] / self.dlat).astype(int)
+            cj = np.floor(coords[:, 1] / self.dlon).astype(int)
+            ordine = np.lexsort((cj, ci))
+            tagli = np.flatnonzero((np.diff(ci[ordine]) != 0) | (np.diff(cj[ordine]) != 0)) + 1
+            for gruppo in np.split(ordine, tagli):
+                self.celle[(int(ci[gruppo[0]]), int(cj[gruppo[0]]))] = gruppo.tolist()
+        self.box = (coords.min(axis=0), coords.max(axis=0)) if len(coords) else None
+        self._lock = threading.RLock()
+        self._aggiorna_vip()
+
+    def _cella(self, c):
+        return (int(math.floor(c[0] / self.dlat)), int(math.floor(c[1] / self.dlon)))
+
+    def _aggiorna_vip(self):
+        self.vip = set(np.flatnonzero(self.bonus >= SOGLIA_VIP).tolist())
+        normali = self.bonus[self.bonus < SOGLIA_VIP]
+        self.bonus_max = float(normali.max()) if len(normali) else 0.0
+
+    def __len__(self):
+        return int(self.attivi.sum())
+
+    def aggiungi(self, chiave, coords, bonus=0.0):
+        with self._lock: return self._aggiungi(chiave, coords, bonus)
+
+    def _aggiungi(self, chiave, coords, bonus):
+        if chiave in self.pos:
+            i = self.pos[chiave]
+            if self.attivi[i] and tuple(self.coords[i]) == tuple(coords): return i
+            self.rimuovi(chiave)
+        i = len(self.coords)
+        self.coords = np.vstack([self.coords, np.asarray(coords, dtype=float).reshape(1, 2)])
+        self.bonus = np.append(self.bonus, bonus)
+        self.attivi = np.append(self.attivi, True)
+        self.chiavi.append(chiave)
+        self.pos[chiave] = i
+        self.celle.setdefault(self._cella(self.coords[i]), []).append(i)
+        c = self.coords[i]
+        self.box = (np.minimum(self.box[0], c), np.maximum(self.box[1], c)) if self.box is not None else (c.copy(), c.copy())
+        if bonus >= SOGLIA_VIP: self.vip.add(i)
+        else: self.bonus_max = max(self.bonus_max, float(bonus))
+        return i
+
+    def rimuovi(self, chiave):
+        # Es. cliente visitato o già nel giro: resta in memoria ma esce dalle ricerche
+        with self._lock:
+            i = self.pos.get(chiave)
+            if i is None or not self.attivi[i]: return
+            self.attivi[i] = False
+            self.vip.discard(i)
+            cella = self.celle.get(self._cella(self.coords[i]))
+            if cella and i in cella: cella.remove(i)
+
+    def _anelli(self, punto):
+        ci, cj = self._cella(punto)
+        r = 0
+        while True:
+            if r == 0: celle = [(ci, cj)]
+            else:
+                celle = [(ci + di, cj + dj) for di in (-r, r) for dj in range(-r, r + 1)]
+                celle += [(ci + di, cj + dj) for dj in (-r, r) for di in range(-r + 1, r)]
+            yield r, [i for c in celle for i in self.celle.get(c, ())]
+            r += 1
+
+    def _score(self, punto, idx, prioritari):
+        score = matrice_haversine([punto], self.coords[idx])[0] - self.bonus[idx]
+        if prioritari: score -= PRIORITA * np.isin(idx, list(prioritari))
+        return score
+
+    def k_vicini(self, punto, k, escludi=(), prioritari=()):
+        # Indici dei k migliori per (km - bonus) tra i punti attivi; "prioritari" = VIP per questa ricerca
+        with self._lock: return self._k_vicini(punto, k, escludi, prioritari)
+
+    def _k_vicini(self, punto, k, escludi, prioritari):
+        if not len(self) or k <= 0: return np.array([], dtype=int)
+        escludi = set(escludi)
+        prioritari = {i for i in prioritari if self.attivi[i] and i not in escludi}
+        sempre = self.vip | prioritari
+        trovati = [i for i in sempre if i not in escludi]
+        raggio_max = self._raggio_massimo(punto)
+        for r, indici in self._anelli(punto):
+            trovati.extend(i for i in indici if i not in escludi and i not in sempre)
+            # Oltre l'anello r la distanza è almeno r * cella_km
+            if len(trovati) >= k:
+                score = self._score(punto, np.array(trovati), prioritari)
+                if np.partition(score, k - 1)[k - 1] <= r * self.cella_km - self.bonus_max: break
+            if r * self.cella_km > raggio_max: break
+        if not trovati: return np.array([], dtype=int)
+        idx = np.array(trovati)
+        return idx[np.argsort(self._score(punto, idx, prioritari), kind="stable")[:k]]
+
+    def vicini(self, punto, k, escludi=(), prioritari=()):
+        # Come k_vicini ma per chiave: [(chiave, km)]
+        with self._lock:
+            escludi = [self.pos[c] for c in escludi if c in self.pos]
+            prioritari = [self.pos[c] for c in prioritari if c in self.pos]
+            idx = self._k_vicini(punto, k, escludi, prioritari)
+            km = matrice_haversine([punto], self.coords[idx])[0] if len(idx) else []
+            return [(self.chiavi[i], float(d)) for i, d in zip(idx, km)]
+
+    def nel_raggio(self, punto, km, escludi=(), prioritari=()):
+        # Indici con (km - bonus) <= km tra i punti attivi, dal migliore: il bonus attività allarga
+        # il raggio, VIP e "prioritari" sono sempre dentro (come in k_vicini)
+        with self._lock: return self._nel_raggio(punto, km, escludi, prioritari)
+
+    def _nel_raggio(self, punto, km, escludi, prioritari):
+        if not len(self): return np.array([], dtype=int)
+        escludi = set(escludi)
+        prioritari = {i for i in prioritari if self.attivi[i] and i not in escludi}
+        sempre = self.vip | prioritari
+        trovati = [i for i in sempre if i not in escludi]
+        raggio_max = min(km + self.bonus_max, self._raggio_massimo(punto))
+        for r, indici in self._anelli(punto):
+            trovati.extend(i for i in indici if i not in escludi and i not in sempre)
+            if r * self.cella_km > raggio_max: break
+        if not trovati: return np.array([], dtype=int)
+        idx = np.array(trovati)
+        score = self._score(punto, idx, prioritari)
+        dentro = score <= km
+        return idx[dentro][np.argsort(score[dentro], kind="stable")]
+
+    def _raggio_massimo(self, punto):
+        # Distanza oltre la quale non ci sono più celle occupate (box di tutti i punti mai inseriti)
+        if self.box is None: return 0.0
+        lo, hi = self.box
+        span = np.maximum(np.abs(hi - punto), np.abs(punto - lo)).max() * KM_PER_GRADO
+        return float(span) + 2 * self.cella_km
+
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I moduli dell'app stanno nella radice del repo (niente pacchetto installabile)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,48 @@
+import time
+
+import pytz
+
+from meteo import PrevisioniMeteo
+
+ZONE = {"Firenze": (43.7696, 11.2558), "Arezzo": (43.4631, 11.8781)}
+ORE = {"temperature_2m": [15] * 24, "precipitation_probability": [10] * 24}
+
+
+class EsecutoreFinto:
+    def __init__(self): self.lavori = []
+    def submit(self, fn, *args): self.lavori.append((fn, args))
+
+
+class HttpFinto:
+    def __init__(self, guasto=False):
+        self.executor = EsecutoreFinto()
+        self.chiamate = 0
+        self.guasto = guasto
+
+    def get_json(self, endpoint, url, params=None, timeout=None):
+        self.chiamate += 1
+        if self.guasto: raise ConnectionError("open-meteo giù")
+        return [{"hourly": ORE} for _ in params["latitude"].split(",")]
+
+
+def test_cache_fredda_scarica_subito():
+    http = HttpFinto()
+    meteo = PrevisioniMeteo(http, pytz.timezone("Europe/Rome"))
+    assert set(meteo.leggi(ZONE)) == set(ZONE)
+    assert http.chiamate == 1 and not http.executor.lavori
+
+
+def test_scadute_in_background():
+    http = HttpFinto()
+    meteo = PrevisioniMeteo(http, pytz.timezone("Europe/Rome"), ttl_min=0)
+    meteo.leggi(ZONE)
+    assert set(meteo.leggi(ZONE)) == set(ZONE)   # servite scadute
+    assert http.chiamate == 1 and len(http.executor.lavori) == 1
+
+
+def test_errore_mette_in_pausa():
+    http = HttpFinto(guasto=True)
+    meteo = PrevisioniMeteo(http, pytz.timezone("Europe/Rome"))
+    assert meteo.leggi(ZONE) == {}
+    assert meteo.leggi(ZONE) == {}
+    assert http.chiamate == 1 and meteo.pausa_fino > time.time()
@@ -0,0 +1,49 @@
+import numpy as np
+
+from spatial import IndiceSpaziale, PRIORITA, matrice_haversine
+
+CENTRO = np.array([43.7, 11.3])
+
+
+def caso(rng):
+    # Punti sparsi e ammassati, bonus attività e qualche VIP, alcuni rimossi
+    n = int(rng.integers(1, 400))
+    coords = CENTRO + rng.normal(0, rng.choice([0.01, 0.1, 0.3]), (n, 2))
+    bonus = rng.choice([0.0, 5.0], n, p=[0.8, 0.2]) + rng.choice([0.0, 100000.0], n, p=[0.97, 0.03])
+    indice = IndiceSpaziale(coords, bonus, cella_km=float(rng.choice([0.5, 2.0, 5.0])))
+    attivi = np.ones(n, dtype=bool)
+    for i in rng.choice(n, size=n // 5, replace=False): indice.rimuovi(int(i)); attivi[i] = False
+    punto = CENTRO + rng.normal(0, 0.2, 2)
+    escludi = set(rng.choice(n, size=min(n, 5), replace=False).tolist())
+    prioritari = set(rng.choice(n, size=min(n, 2), replace=False).tolist()) if rng.random() < 0.5 else set()
+    return indice, coords, bonus, attivi, punto, escludi, prioritari
+
+
+def score_forza_bruta(coords, bonus, attivi, punto, escludi, prioritari):
+    idx = np.array([i for i in range(len(coords)) if attivi[i] and i not in escludi], dtype=int)
+    score = matrice_haversine([punto], coords[idx])[0] - bonus[idx] - PRIORITA * np.isin(idx, list(prioritari))
+    return idx, score
+
+
+def test_k_vicini_come_forza_bruta():
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        indice, coords, bonus, attivi, punto, escludi, prioritari = caso(rng)
+        k = int(rng.integers(1, 30))
+        idx, score = score_forza_bruta(coords, bonus, attivi, punto, escludi, prioritari)
+        attesi = np.sort(score)[:k]
+        trovati = indice.k_vicini(punto, k, escludi, prioritari)
+        _, s = score_forza_bruta(coords, bonus, attivi, punto, set(range(len(coords))) - set(trovati.tolist()), prioritari)
+        assert np.allclose(np.sort(s), attesi)
+
+
+def test_nel_raggio_come_forza_bruta():
+    rng = np.random.default_rng(1)
+    for _ in range(300):
+        indice, coords, bonus, attivi, punto, escludi, prioritari = caso(rng)
+        km = float(rng.uniform(0, 40))
+        idx, score = score_forza_bruta(coords, bonus, attivi, punto, escludi, prioritari)
+        trovati = indice.nel_raggio(punto, km, escludi, prioritari)
+        assert set(trovati.tolist()) == set(idx[score <= km].tolist())
+        s = dict(zip(idx.tolist(), score))
+        assert all(s[a] <= s[b] for a, b in zip(trovati, trovati[1:]))
@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+import bench
+from clienti import TabellaClienti
+from durations import ModelloDurate
+from planner import finestra_giornata, pianifica_giro, seleziona_candidati
+from replanner import ritima_giro
+
+
+class EsecutoreFinto:
+    # Raccoglie i lavori di background invece di eseguirli
+    def __init__(self): self.lavori = []
+    def submit(self, fn, *args): self.lavori.append((fn, args))
+
+
+class HttpFinto:
+    def __init__(self): self.executor = EsecutoreFinto()
+    def mappa(self, fn, lista): return [fn(x) for x in lista]
+
+
+def giro_pianificato(motore):
+    righe, verita, log, vip = bench.genera_clienti(300, 42)
+    tabella = TabellaClienti(righe)
+    start_t, limit = finestra_giornata(bench.PARTENZA)
+    geo = lambda clienti: [{"coords": verita[n], "tel": "", "found": True} if n in verita else {"coords": None, "found": False} for n, *_ in clienti]
+    rotta = pianifica_giro(seleziona_candidati(tabella, sel_forced=vip), tabella, vip, 12, start_t, limit, bench.SEDE,
+                           geo, ModelloDurate(bench.FoglioFinto(log)).durata, motore)
+    return rotta, limit
+
+
+def test_fatto_in_altra_fascia_non_chiama_api_nel_click():
+    http = HttpFinto()
+    motore = bench.MotoreFinto("finta", http=http)
+    rotta, limit = giro_pianificato(motore)
+    assert len(rotta) > 3
+    fatta = rotta.pop(0)
+    adesso = bench.PARTENZA + timedelta(hours=2)   # un'altra fascia oraria
+    prima = motore.chiamate
+    ritima_giro(rotta, 0, fatta['g_data']['coords'], adesso, limit, motore, adesso)
+    assert motore.chiamate == prima               # nessuna richiesta sincrona
+    assert len(http.executor.lavori) == 1         # la fascia corrente si aggiorna in background
+    fn, args = http.executor.lavori[0]
+    fn(*args)
+    assert motore.chiamate > prima
+    # Dopo il rinfresco le stesse tratte sono in cache nella fascia corrente
+    http.executor.lavori.clear()
+    dopo = motore.chiamate
+    ritima_giro(rotta, 0, fatta['g_data']['coords'], adesso, limit, motore, adesso)
+    assert motore.chiamate == dopo and not http.executor.lavori
+
+
+def test_tratte_mai_viste_si_scaricano_subito():
+    motore = bench.MotoreFinto("finta", http=HttpFinto())
+    minuti = motore.tempi_tratte([((43.70, 11.30), (43.80, 11.40))], bench.PARTENZA, altre_fasce=True)
+    assert motore.chiamate == 1 and minuti[0] > 0
@@ -0,0 +1,72 @@
+from gspread.utils import a1_to_rowcol
+
+from writeback import CodaScritture
+
+COL_NOME, COL_VIS = 1, 5
+
+
+class Cella:
+    def __init__(self, row):
+        self.row = row
+
+
+class FoglioFinto:
+    # Solo quello che usa la coda per le celle: batch_get, find, batch_update
+    id = 1
+
+    def __init__(self, nomi, guasto=None):
+        self.griglia = {(r, COL_NOME): n for r, n in nomi.items()}
+        self.scritte = {}
+        self.guasto = guasto   # "batch_get" / "find": la prossima chiamata fallisce
+
+    def _forse_guasto(self, cosa):
+        if self.guasto == cosa:
+            self.guasto = None
+            raise ConnectionError(f"{cosa} non raggiungibile")
+
+    def batch_get(self, ranges):
+        self._forse_guasto("batch_get")
+        return [[[self.griglia[a1_to_rowcol(r)]]] if a1_to_rowcol(r) in self.griglia else [] for r in ranges]
+
+    def find(self, testo, in_column=None):
+        self._forse_guasto("find")
+        return next((Cella(r) for (r, c), v in self.griglia.items() if v == testo and c == in_column), None)
+
+    def batch_update(self, dati, **kw):
+        for d in dati: self.scritte[a1_to_rowcol(d["range"])] = d["values"][0][0]
+
+
+def coda(spostate):
+    # attesa lunga: il thread di background non parte durante il test, si chiama flush a mano
+    return CodaScritture(attesa=3600, su_righe_spostate=lambda: spostate.append(1))
+
+
+def test_riga_giusta_scritta_senza_ricerca():
+    spostate, ws = [], FoglioFinto({2: "ROSSI"})
+    q = coda(spostate)
+    q.aggiorna_cella(ws, 2, COL_VIS, "SI", attesa=(COL_NOME, "ROSSI"))
+    assert q.flush()
+    assert ws.scritte == {(2, COL_VIS): "SI"} and not spostate
+
+
+def test_riga_spostata_e_cliente_sparito():
+    spostate, ws = [], FoglioFinto({2: "BIANCHI", 3: "ROSSI", 4: "VERDI"})
+    q = coda(spostate)
+    q.aggiorna_cella(ws, 2, COL_VIS, "SI", attesa=(COL_NOME, "ROSSI"))   # ROSSI ora è alla riga 3
+    q.aggiorna_cella(ws, 4, COL_VIS, "SI", attesa=(COL_NOME, "VERDI"))   # invariata
+    q.aggiorna_cella(ws, 9, COL_VIS, "SI", attesa=(COL_NOME, "NERI"))    # non più nel foglio
+    assert q.flush()
+    assert ws.scritte == {(3, COL_VIS): "SI", (4, COL_VIS): "SI"}
+    assert spostate == [1] and q.in_attesa() == 0
+
+
+def test_ricerca_fallita_non_perde_la_scrittura():
+    for guasto in ("batch_get", "find"):
+        spostate, ws = [], FoglioFinto({2: "BIANCHI", 3: "ROSSI"}, guasto=guasto)
+        q = coda(spostate)
+        q.aggiorna_cella(ws, 2, COL_VIS, "SI", attesa=(COL_NOME, "ROSSI"))
+        assert not q.flush()
+        assert q.in_attesa() == 1 and ws.scritte == {}
+        # Al giro successivo la verifica riparte dalla riga originale e trova quella giusta
+        assert q.flush()
+        assert ws.scritte == {(3, COL_VIS): "SI"} and q.in_attesa() == 0
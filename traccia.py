@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# --- STRUMENTAZIONE (span di tempo, contatori ed errori per ogni rerun) ---
+# Ogni rerun apre una Traccia legata al thread dello script; i lavori mandati al pool
+# HTTP la portano con sé (legata). Quello che gira fuori da un rerun (coda scritture,
+# meteo in background) finisce nella traccia di processo.
+log = logging.getLogger("crm")
+MAX_SPAN = 2000
+MAX_ERRORI = 200
+
+
+class Traccia:
+    def __init__(self, nome="processo"):
+        self.nome = nome
+        self.inizio = datetime.now()
+        self.t0 = time.perf_counter()
+        self.span = deque(maxlen=MAX_SPAN)   # (nome, inizio_ms, ms, errore, attributi); oltre il limite escono i più vecchi
+        self.contatori = {}
+        self.errori = deque(maxlen=MAX_ERRORI)   # (ms, dove, messaggio)
+        self.scartati = 0
+        self._lock = threading.Lock()
+
+    def aggiungi_span(self, nome, t_inizio, ms, errore=None, attributi=None):
+        with self._lock:
+            if len(self.span) == MAX_SPAN: self.scartati += 1
+            self.span.append((nome, (t_inizio - self.t0) * 1000, ms, errore, attributi or {}))
+
+    def conta(self, nome, n=1):
+        with self._lock: self.contatori[nome] = self.contatori.get(nome, 0) + n
+
+    def errore(self, dove, e):
+        with self._lock:
+            self.contatori[f"errori.{dove}"] = self.contatori.get(f"errori.{dove}", 0) + 1
+            self.errori.append((self.durata_ms(), dove, f"{type(e).__name__}: {e}"))
+
+    def durata_ms(self):
+        return (time.perf_counter() - self.t0) * 1000
+
+    def riepilogo(self):
+        # Per nome di span: quante volte, ms totali e massimi, errori (ordinato per ms totali)
+        out = {}
+        with self._lock:
+            for nome, _, ms, errore, _ in self.span:
+                s = out.setdefault(nome, {"n": 0, "ms_totali": 0.0, "ms_max": 0.0, "errori": 0})
+                s["n"] += 1; s["ms_totali"] += ms; s["ms_max"] = max(s["ms_max"], ms); s["errori"] += int(errore is not None)
+        return dict(sorted(out.items(), key=lambda kv: -kv[1]["ms_totali"]))
+
+    def esporta(self):
+        with self._lock:
+            span = [{"nome": n, "inizio_ms": round(t, 2), "ms": round(ms, 2), **({"errore": e} if e else {}), **({"attributi": a} if a else {})}
+                    for n, t, ms, e, a in self.span]
+            contatori, errori = dict(self.contatori), [{"ms": round(t, 2), "dove": d, "errore": m} for t, d, m in self.errori]
+        return {"nome": self.nome, "inizio": self.inizio.isoformat(timespec="seconds"), "durata_ms": round(self.durata_ms(), 2),
+                "riepilogo": self.riepilogo(), "contatori": contatori, "errori": errori, "span": span, "span_scartati": self.scartati}
+
+
+PROCESSO = Traccia()
+_locale = threading.local()
+
+
+def attiva():
+    return getattr(_locale, "traccia", None) or PROCESSO
+
+
+def inizia(nome="rerun"):
+    # Nuova traccia per il thread corrente (uno script Streamlit = un rerun)
+    _locale.traccia = Traccia(nome)
+    return _locale.traccia
+
+
+@contextmanager
+def span(nome, **attributi):
+    t, t0, errore = attiva(), time.perf_counter(), None
+    try: yield attributi  # il blocco può aggiungere attributi (es. righe lette)
+    except Exception as e:
+        errore = f"{type(e).__name__}: {e}"
+        raise
+    finally: t.aggiungi_span(nome, t0, (time.perf_counter() - t0) * 1000, errore, attributi)
+
+
+def segna(nome, t0, **attributi):
+    # Per blocchi lunghi dove un with sarebbe scomodo: span da t0 (perf_counter) a adesso
+    attiva().aggiungi_span(nome, t0, (time.perf_counter() - t0) * 1000, None, attributi)
+
+
+def conta(nome, n=1):
+    attiva().conta(nome, n)
+
+
+def errore(dove, e):
+    # Al posto dei vecchi except muti: log + contatore + voce nella traccia
+    log.warning("Errore %s: %s", dove, e)
+    attiva().errore(dove, e)
+
+
+def legata(fn):
+    # fn eseguita in un altro thread scrive nella traccia di chi l'ha lanciata
+    t = attiva()
+    def eseguita(*args, **kwargs):
+        prima = getattr(_locale, "traccia", None)
+        _locale.traccia = t
+        try: return fn(*args, **kwargs)
+        finally: _locale.traccia = prima
+    return eseguita
@@ -0,0 +1,162 @@
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import requests
+
+from optimizer import minuti_stimati
+from spatial import matrice_haversine
+from traccia import conta, errore, legata
+
+# --- MOTORE TEMPI DI GUIDA (Distance Matrix a blocchi + cache per tratta) ---
+DM_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+DM_MAX_LATO = 25          # max origini / destinazioni per richiesta
+DM_MAX_ELEMENTI = 100     # max origini x destinazioni per richiesta
+VEL_SENZA_KEY = 40        # senza chiave API: geodetica x 1.5 a 40 km/h, come il calcolo originale
+VEL_FALLBACK = 45
+
+
+class MotoreTempiGuida:
+    def __init__(self, api_key=None, bucket_min=60, ttl_ore=12, decimali=4, timeout=10, http=None):
+        self.api_key = api_key
+        self.http = http
+        self.bucket_min = bucket_min
+        self.ttl = ttl_ore * 3600
+        self.decimali = decimali
+        self.timeout = timeout
+        self.cache = {}  # (o, d, bucket) -> (minuti, ts)
+        self.recenti = {}  # (o, d) -> (minuti, ts): ultimo valore scaricato, qualsiasi fascia
+        self.in_rinfresco = set()  # (o, d, bucket) in scaricamento in background
+        self.chiamate = self.elementi = self.hits = self.fallback = 0
+        self._lock = threading.Lock()
+
+    def _punto(self, c):
+        return (round(float(c[0]), self.decimali), round(float(c[1]), self.decimali))
+
+    def _bucket(self, quando):
+        quando = quando or datetime.now()
+        return f"{quando.weekday()}-{(quando.hour * 60 + quando.minute) // self.bucket_min}"
+
+    def _dalla_cache(self, coppie, bucket, altre_fasce):
+        # {(o, d): minuti} per le coppie in cache nella fascia; con altre_fasce anche il valore più
+        # recente di un'altra fascia (da rinfrescare). Ritorna trovati, mancanti, da rinfrescare.
+        trovati, mancanti, vecchi = {}, set(), set()
+        adesso = time.time()
+        with self._lock:
+            for o, d in coppie:
+                if o == d: trovati[(o, d)] = 0; continue
+                voce = self.cache.get((o, d, bucket))
+                if voce and adesso - voce[1] < self.ttl: trovati[(o, d)] = voce[0]; continue
+                recente = self.recenti.get((o, d)) if altre_fasce else None
+                if recente: trovati[(o, d)] = recente[0]; vecchi.add((o, d))
+                else: mancanti.add((o, d))
+            self.hits += len(trovati) - len(vecchi)
+        conta("distance_matrix.cache_hit", len(trovati) - len(vecchi))
+        conta("distance_matrix.altra_fascia", len(vecchi))
+        conta("distance_matrix.cache_miss", len(mancanti))
+        return trovati, mancanti, vecchi
+
+    def _completa(self, coppie, bucket, quando, altre_fasce, incrocia):
+        # Minuti per ogni coppia: cache, poi API per le mancanti (le "vecchie" in background),
+        # infine geodetica x 1.5 per quello che manca ancora
+        trovati, mancanti, vecchi = self._dalla_cache(coppie, bucket, altre_fasce)
+        if mancanti and self.api_key:
+            self._scarica(mancanti, bucket, quando, incrocia)
+            with self._lock:
+                for o, d in mancanti:
+                    voce = self.cache.get((o, d, bucket))
+                    if voce: trovati[(o, d)] = voce[0]
+        if vecchi and self.api_key: self._rinfresca(vecchi, bucket, quando)
+        buchi = [c for c in coppie if c not in trovati]
+        if buchi:
+            stima = minuti_stimati(np.diagonal(matrice_haversine([o for o, _ in buchi], [d for _, d in buchi])), VEL_FALLBACK if self.api_key else VEL_SENZA_KEY)
+            trovati.update(zip(buchi, stima))
+            with self._lock: self.fallback += len(buchi)
+            conta("distance_matrix.fallback", len(buchi))
+        return trovati
+
+    def _rinfresca(self, coppie, bucket, quando):
+        # Fascia corrente scaricata fuori dal click; una sola volta per coppia e fascia
+        with self._lock:
+            coppie = {c for c in coppie if (*c, bucket) not in self.in_rinfresco}
+            self.in_rinfresco.update((*c, bucket) for c in coppie)
+        if not coppie: return
+        def lavoro():
+            try: self._scarica(coppie, bucket, quando, incrocia=False)
+            finally:
+                with self._lock: self.in_rinfresco.difference_update((*c, bucket) for c in coppie)
+        if self.http: self.http.executor.submit(legata(lavoro))
+        else: threading.Thread(target=lavoro, daemon=True).start()
+
+    def matrice(self, origini, destinazioni, quando=None, altre_fasce=False):
+        # altre_fasce: per le tratte non in cache in questa fascia oraria va bene l'ultimo
+        # valore noto di un'altra fascia (la fascia corrente si aggiorna in background)
+        origini = [self._punto(o) for o in np.asarray(origini, dtype=float).reshape(-1, 2)]
+        destinazioni = [self._punto(d) for d in np.asarray(destinazioni, dtype=float).reshape(-1, 2)]
+        trovati = self._completa([(o, d) for o in origini for d in destinazioni], self._bucket(quando), quando, altre_fasce, incrocia=True)
+        return np.floor(np.array([[trovati[(o, d)] for d in destinazioni] for o in origini], dtype=float).reshape(len(origini), len(destinazioni)))
+
+    def tempi_tratte(self, coppie, quando=None, altre_fasce=False):
+        # Solo le tratte indicate (es. tappe consecutive del giro), senza prodotto cartesiano
+        coppie = [(self._punto(o), self._punto(d)) for o, d in coppie]
+        if not coppie: return []
+        trovati = self._completa(coppie, self._bucket(quando), quando, altre_fasce, incrocia=False)
+        return [int(np.floor(trovati[c])) for c in coppie]
+
+    def tempo(self, origine, destinazione, quando=None):
+        return int(self.matrice([origine], [destinazione], quando)[0, 0])
+
+    def _scarica(self, mancanti, bucket, quando, incrocia=True):
+        # Raggruppa per origine e riempie blocchi entro i limiti di elementi dell'API.
+        # incrocia=False (tratte sparse): un blocco per origine, si paga solo quello che serve.
+        per_origine = {}
+        for o, d in mancanti: per_origine.setdefault(o, set()).add(d)
+        origini = sorted(per_origine)
+        blocchi = []
+        if not incrocia:
+            for o in origini:
+                dest = sorted(per_origine[o])
+                blocchi.extend(([o], dest[k:k + DM_MAX_LATO]) for k in range(0, len(dest), DM_MAX_LATO))
+            origini = []
+        while origini:
+            blocco_o, dest = [], set()
+            for o in list(origini):
+                unione = dest | per_origine[o]
+                if blocco_o and (len(blocco_o) + 1 > DM_MAX_LATO or (len(blocco_o) + 1) * len(unione) > DM_MAX_ELEMENTI): break
+                blocco_o.append(o); dest = unione; origini.remove(o)
+            dest = sorted(dest)
+            passo = max(1, min(DM_MAX_LATO, DM_MAX_ELEMENTI // len(blocco_o)))
+            blocchi.extend((blocco_o, dest[k:k + passo]) for k in range(0, len(dest), passo))
+        if self.http and len(blocchi) > 1: self.http.mappa(lambda b: self._richiesta(b[0], b[1], bucket, quando), blocchi)
+        else:
+            for o, d in blocchi: self._richiesta(o, d, bucket, quando)
+
+    def _richiesta(self, origini, destinazioni, bucket, quando):
+        partenza = "now"
+        if quando is not None and quando.timestamp() > time.time() + 60: partenza = str(int(quando.timestamp()))
+        params = {
+            "origins": "|".join(f"{o[0]},{o[1]}" for o in origini),
+            "destinations": "|".join(f"{d[0]},{d[1]}" for d in destinazioni),
+            "departure_time": partenza, "mode": "driving", "key": self.api_key,
+        }
+        try:
+            with self._lock: self.chiamate += 1; self.elementi += len(origini) * len(destinazioni)
+            res = self._get(params)
+            if res.get('status') != 'OK': conta("distance_matrix.status_ko"); return
+            ts = time.time()
+            with self._lock:
+                for o, riga in zip(origini, res['rows']):
+                    for d, el in zip(destinazioni, riga['elements']):
+                        if el.get('status') != 'OK': continue
+                        secondi = el.get('duration_in_traffic', el.get('duration', {})).get('value')
+                        if secondi is not None: self.cache[(o, d, bucket)] = self.recenti[(o, d)] = (secondi / 60, ts)
+        except Exception as e: errore("distance_matrix", e)
+
+    def _get(self, params):
+        if self.http: return self.http.get_json("distance_matrix", DM_URL, params=params)
+        return requests.get(DM_URL, params=params, timeout=self.timeout).json()
+
+    def minuti_fn(self, quando=None):
+        # Adattatore per optimizer.ottimizza_giro: matrice reale sui nodi del giro scelto
+        return lambda origini, destinazioni: self.matrice(origini, destinazioni, quando)
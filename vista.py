@@ -0,0 +1,105 @@
+import re
+
+# --- VISTA DEL GIRO (dati delle card calcolati una volta per versione del giro) ---
+# Il giro cambia solo con calcolo, scambio, visita fatta o ricalcolo orari: la firma
+# (clienti, orari, VIP, tabella) dice quando ricostruire. Nei rerun intermedi
+# (checkbox, note, selectbox) le card si disegnano dai dati già pronti.
+CAMPI_INTERNI = {'g_data', 'arr', 'learned', 'travel_time', 'duration', 'NOTE_SESSION', 'oltre_limite'}
+
+
+def _parole(*parole):
+    return re.compile("|".join(map(re.escape, parole)))
+
+
+# Prima regola che trova una parola nelle note storiche (minuscole)
+REGOLE_COACH = [
+    (_parole('arrabbiato', 'reclamo', 'ritardo', 'problema', 'rotto'),
+     "🛡️ COACH: Cliente a rischio. Empatia massima.", "border-left-color: #f87171; background: rgba(153, 27, 27, 0.2);"),
+    (_parole('prezzo', 'costoso', 'sconto', 'caro'),
+     "💎 COACH: Difendi il valore. Non svendere.", "border-left-color: #fb923c; background: rgba(146, 64, 14, 0.2);"),
+    (_parole('interessato', 'preventivo', 'forse'),
+     "🎯 COACH: È caldo! Oggi devi chiudere.", "border-left-color: #4ade80; background: rgba(22, 101, 52, 0.2);"),
+]
+
+
+def agente_strategico(note_precedenti):
+    if not note_precedenti: return "ℹ️ COACH: Nessuno storico recente. Raccogli info.", "border-left-color: #64748b;"
+    txt = str(note_precedenti).lower()
+    for regola, msg, style in REGOLE_COACH:
+        if regola.search(txt): return msg, style
+    return f"ℹ️ MEMO: {str(note_precedenti)[:60]}...", "border-left-color: #94a3b8;"
+
+
+def telefono(p, c_tel):
+    # Priorità al foglio (se sembra un numero), poi Google
+    tel_excel = str(p.get(c_tel, '')).strip()
+    return tel_excel if tel_excel and len(tel_excel) > 5 else p['g_data'].get('tel', '')
+
+
+def html_card(i, p, c_nom, c_ind, c_com, forced, coach, canvass, tel):
+    forced_html = "<span class='forced-badge'>⭐ PRIORITARIO</span>" if forced else ""
+    if p.get('oltre_limite'): forced_html += "<span class='late-badge'>⏰ OLTRE 19:30</span>"
+    canvass_html = f"""
+<div style="background: linear-gradient(90deg, #059669, #10b981); color: white; padding: 10px; border-radius: 8px; margin-bottom: 10px; font-weight: bold; border: 1px solid #34d399;">
+📢 CANVASS: {canvass}
+</div>
+""" if canvass else ""
+    ai_lbl = "AI" if p.get('learned') else "Std"
+    return f"""
+<div class="client-card">
+<div class="card-header">
+<div style="display:flex; align-items:center;">
+{forced_html}
+<span class="client-name">{i+1}. {p[c_nom]}</span>
+</div>
+<div class="arrival-time">{p['arr'].strftime('%H:%M')}</div>
+</div>
+{canvass_html}
+<div class="strategy-box" style="{coach[1]}">
+{coach[0]}
+</div>
+<div class="info-row">
+<span>📍 {p[c_ind]}, {p[c_com]}</span>
+<span class="real-traffic">🚗 Guida: {p['travel_time']} min</span>
+</div>
+<div class="info-row">
+<span class="ai-badge">⏱️ {p['duration']} min ({ai_lbl})</span>
+<span class="highlight">{tel}</span>
+</div>
+</div>
+"""
+
+
+def firma_giro(route, tabella, sel_forced):
+    return (id(tabella), tabella.caricata, frozenset(sel_forced),
+            tuple((p[tabella.c_nom], p['arr'], p['travel_time'], p['duration'], bool(p.get('oltre_limite'))) for p in route))
+
+
+class VistaGiro:
+    def __init__(self, route, tabella, sel_forced=()):
+        c_nom, c_ind, c_com, _, _, c_tel, c_att, c_canv, c_note_sto = tabella.colonne()
+        self.firma = firma_giro(route, tabella, sel_forced)
+        self.tappe = []
+        for i, p in enumerate(route):
+            tel = telefono(p, c_tel)
+            canvass = str(p.get(c_canv, '') or '').strip() if c_canv else ''
+            coach = agente_strategico(p.get(c_note_sto, '') if c_note_sto else '')
+            self.tappe.append({
+                "nome": p[c_nom],
+                "html": html_card(i, p, c_nom, c_ind, c_com, p[c_nom] in sel_forced, coach, canvass, tel),
+                "tel": tel,
+                "attivita": [t.strip() for t in str(p[c_att]).split(',') if t.strip()] if c_att and p.get(c_att) else [],
+                "coords": p['g_data']['coords'],
+            })
+        self.nel_giro = {t["nome"] for t in self.tappe}
+        # Candidati allo scambio: tutti i clienti fuori dal giro, filtrati una volta sola
+        self.fuori_giro = [c for c in tabella.clienti_ordinati if c not in self.nel_giro]
+
+    def candidati(self, vicini):
+        # Prima i vicini (indice spaziale), poi gli altri in ordine alfabetico
+        return list(vicini) + [c for c in self.fuori_giro if c not in vicini]
+
+
+def anagrafica(p):
+    # Solo i campi del foglio, per la scheda CRM (disegnata solo se aperta)
+    return {k: v for k, v in p.items() if k not in CAMPI_INTERNI}
@@ -0,0 +1,134 @@
+import threading
+import time
+
+from gspread.utils import rowcol_to_a1
+
+from traccia import errore, span
+
+# --- CODA DI SCRITTURA (write-behind verso Google Sheets) ---
+# Le scritture si accumulano e partono a blocchi: celle -> batch_update,
+# righe log -> append_rows, memoria giro -> un solo update (vince l'ultima).
+# La memoria parte prima delle righe: gli eventi accodati dopo una compattazione
+# finiscono sotto il nuovo snapshot.
+# Le celle con un nome atteso (riga presa da una tabella in cache) si verificano con un
+# batch_get prima di scrivere: se il foglio è cambiato la riga si ritrova con find.
+# La coda vive nel processo: sopravvive ai rerun, non a un riavvio dell'app.
+ATTESA_FLUSH_SEC = 1.5
+ATTESA_ERRORE_SEC = 10
+
+
+class CodaScritture:
+    def __init__(self, attesa=ATTESA_FLUSH_SEC, su_righe_spostate=None):
+        self.attesa = attesa
+        self.su_righe_spostate = su_righe_spostate  # es. invalidare la tabella clienti in cache
+        self.celle = {}      # ws_id -> (ws, {(riga, col): valore})
+        self.attesi = {}     # ws_id -> {(riga, col): (col_nome, nome)}
+        self.righe = {}      # ws_id -> (ws, [righe])
+        self.memoria = {}    # ws_id -> (ws, righe)
+        self.chiamate = self.errori = 0
+        self._lock = threading.Lock()
+        self._evento = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def aggiorna_cella(self, ws, riga, col, valore, attesa=None):
+        # attesa = (col_nome, nome): la riga è valida solo se in col_nome c'è ancora nome
+        with self._lock:
+            self.celle.setdefault(ws.id, (ws, {}))[1][(riga, col)] = valore
+            if attesa: self.attesi.setdefault(ws.id, {})[(riga, col)] = attesa
+        self._sveglia()
+
+    def accoda_righe(self, ws, righe):
+        with self._lock: self.righe.setdefault(ws.id, (ws, []))[1].extend(righe)
+        self._sveglia()
+
+    def salva_memoria(self, ws, righe):
+        with self._lock: self.memoria[ws.id] = (ws, righe)
+        self._sveglia()
+
+    def scarta_righe(self, ws):
+        # Righe non ancora partite e ormai superate (es. eventi inclusi in uno snapshot)
+        with self._lock: self.righe.pop(ws.id, None)
+
+    def in_attesa(self):
+        with self._lock:
+            return sum(len(v) for _, v in self.celle.values()) + sum(len(v) for _, v in self.righe.values()) + len(self.memoria)
+
+    def _sveglia(self):
+        self._evento.set()
+        if not self._thread or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._ciclo, name="coda-scritture", daemon=True)
+            self._thread.start()
+
+    def _ciclo(self):
+        while True:
+            self._evento.wait()
+            time.sleep(self.attesa)  # raccoglie le scritture ravvicinate
+            self._evento.clear()
+            if not self.flush(): time.sleep(ATTESA_ERRORE_SEC); self._evento.set()
+
+    def flush(self):
+        # Ritorna False se qualcosa non è stato scritto (resta in coda)
+        with self._flush_lock:
+            with self._lock:
+                celle, self.celle = self.celle, {}
+                attesi, self.attesi = self.attesi, {}
+                righe, self.righe = self.righe, {}
+                memoria, self.memoria = self.memoria, {}
+            ok, bloccati = True, set()
+            for ws_id, (ws, valori) in celle.items():
+                controlli = attesi.get(ws_id, {})
+                if controlli and not self._esegui(lambda: self._verifica(ws, valori, controlli), "verifica"): scritte = False
+                else:
+                    dati = [{"range": rowcol_to_a1(r, c), "values": [[v]]} for (r, c), v in valori.items()]
+                    scritte = not dati or self._esegui(lambda: ws.batch_update(dati, value_input_option="USER_ENTERED"), "celle")
+                if not scritte:
+                    ok = False
+                    with self._lock:
+                        pendenti = self.celle.setdefault(ws_id, (ws, {}))[1]
+                        for k, v in valori.items(): pendenti.setdefault(k, v)
+                        for k, a in controlli.items():
+                            if k in valori: self.attesi.setdefault(ws_id, {}).setdefault(k, a)
+            for ws_id, (ws, valori) in memoria.items():
+                fine = rowcol_to_a1(len(valori), max(len(r) for r in valori))
+                if not self._esegui(lambda: ws.update(range_name=f"A1:{fine}", values=valori, value_input_option="RAW"), "memoria"):
+                    ok = False
+                    bloccati.add(ws_id)  # le righe dello stesso foglio aspettano lo snapshot
+                    with self._lock: self.memoria.setdefault(ws_id, (ws, valori))
+            for ws_id, (ws, nuove) in righe.items():
+                if ws_id in bloccati or not self._esegui(lambda: ws.append_rows(nuove, value_input_option="RAW"), "righe"):
+                    ok = False
+                    with self._lock:
+                        pendenti = self.righe.setdefault(ws_id, (ws, []))[1]
+                        pendenti[:0] = nuove
+            return ok
+
+    def _verifica(self, ws, valori, controlli):
+        # Un batch_get dei nomi; le celle finite su un altro cliente si spostano sulla riga giusta.
+        # Gli spostamenti si applicano solo dopo tutte le letture: se una fallisce valori resta
+        # com'era e torna in coda intatto.
+        chiavi = [k for k in controlli if k in valori]
+        letti = ws.batch_get([rowcol_to_a1(r, controlli[(r, c)][0]) for r, c in chiavi])
+        spostamenti = {}   # (riga, col) vecchia -> (riga, col) nuova, None = cliente sparito
+        for (r, c), cella in zip(chiavi, letti):
+            col_nome, nome = controlli[(r, c)]
+            if str(cella[0][0] if cella and cella[0] else "").strip() == str(nome).strip(): continue
+            trovata = ws.find(str(nome), in_column=col_nome)
+            spostamenti[(r, c)] = (trovata.row, c) if trovata else None
+        for vecchia, nuova in spostamenti.items():
+            valore, attesa = valori.pop(vecchia), controlli[vecchia]
+            if nuova: valori.setdefault(nuova, valore); controlli[nuova] = attesa
+            else: errore("scrittura.verifica", LookupError(f"{attesa[1]} non più nel foglio"))
+        if spostamenti and self.su_righe_spostate:
+            try: self.su_righe_spostate()
+            except Exception as e: errore("scrittura.righe_spostate", e)
+
+    def _esegui(self, fn, cosa):
+        try:
+            with span(f"sheets.scrittura.{cosa}"): fn()
+            self.chiamate += 1
+            return True
+        except Exception as e:
+            self.errori += 1
+            errore(f"scrittura.{cosa}", e)
+            return False